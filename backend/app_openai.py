@@ -1,60 +1,169 @@
 import os
 import uuid
-from flask import Flask, request, jsonify, send_file
-from utils_openai import extract_texts_from_pdfs ,extract_text_from_image, initialize_retriever, generate_report, save_to_pdf1
+import threading
+from flask import Flask, Response, g, request, jsonify, send_from_directory
+from utils_openai import extract_texts_from_pdfs ,extract_texts_from_images, initialize_retriever, generate_report, save_to_pdf1, get_warm_index, questions_prompts, REPORT_FONT, warm_up_llm
+from jobs import JobQueue, sse_stream
+from report_runner import expand_questions
+from tracing import Trace, instrument_app, job_trace, span
+from report_renderer import warm_up as warm_up_renderer
+from artifact_store import ArtifactStore
 
 app = Flask(__name__)
+# 下載時交給 web server 用 X-Sendfile 傳檔 (前面有 Apache / lighttpd 等支援的 server 時才開)
+app.use_x_sendfile = os.getenv("USE_X_SENDFILE", "false").lower() == "true"
+# /metrics 與每個請求的 trace id
+instrument_app(app)
+
+# 報告產生在背景執行，/upload 只負責存檔並回傳 job id
+job_queue = JobQueue()
 
 UPLOAD_FOLDER = "../upload"
 REPORT_FOLDER = "../report"
 
+# 上傳檔案與報告都依 job id 分目錄存放，背景執行緒定期清掉過期 (ARTIFACT_TTL) 或超過容量上限的目錄
+upload_store = ArtifactStore(UPLOAD_FOLDER)
+report_store = ArtifactStore(REPORT_FOLDER)
+
+# 報告檔名不會重複也不會被覆寫，瀏覽器可以一直快取
+REPORT_MAX_AGE = int(os.getenv("REPORT_MAX_AGE", "86400"))
+
+_services_started = False
+_services_lock = threading.Lock()
+
+def start_background_services():
+    # 預熱與背景執行緒不在 import 時啟動：spawn 啟動的 worker process 會重新 import 這個模組，
+    # debug 模式下 reloader 的父 process 也會執行一次
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    # 啟動時就先載入 embedding model 與知識庫索引，/upload 不再重複載入
+    get_warm_index().warm_up_in_background()
+    # PDF renderer 的 worker process 與字型也先準備好
+    warm_up_renderer(REPORT_FONT)
+    # Ollama 模型先載入並以 keep_alive 保持常駐
+    warm_up_llm()
+    upload_store.start_cleanup()
+    report_store.start_cleanup()
+
+@app.before_request
+def ensure_background_services():
+    # 由 WSGI server 載入時不會經過 __main__，第一個請求時才啟動
+    start_background_services()
+
 @app.route('/upload', methods=['POST'])
 def model_response():
+    job = submit_upload()
 
+    return jsonify({"job_id": job.id, "trace_id": job.trace_id, "status_url": f"/jobs/{job.id}"}), 202
+
+def submit_upload():
     files = request.files.getlist('files') 
     company_name = request.form['company_name']
+    stream_tokens = request.form.get('stream_tokens') == 'true'
+
+    # 排隊中與執行中的工作不會被清除，build_report 結束時才解除
+    job_id = uuid.uuid4().hex
+    upload_store.pin(job_id)
+    report_store.pin(job_id)
+    try:
+        saved_files = []
+        for file in files:
+            unique_filename = f"{uuid.uuid4().hex}.pdf"
+            temp_file_path = upload_store.save_upload(job_id, file, unique_filename)
+            saved_files.append((file.filename, temp_file_path))
+    except Exception:
+        upload_store.unpin(job_id)
+        report_store.unpin(job_id)
+        raise
+
+    return job_queue.submit(build_report, saved_files, company_name, stream_tokens, g.trace, job_id=job_id,
+                            trace_id=g.trace.id)
+
+def build_report(job, saved_files, company_name, stream_tokens=False, trace=None):
+    # 整份報告的每個階段都記在同一個 trace，完成後在 PDF 旁寫出 timing 摘要
+    trace = trace or Trace(job.trace_id)
+    with job_trace(trace), upload_store.released(job.id), report_store.released(job.id):
+        job.start_stage("extract")
+        with span("stage_extract", files=len(saved_files)):
+            # 同類型的檔案一起批次處理，PDF 與圖片都會平行抽取
+            pdf_paths = [path for filename, path in saved_files if filename.endswith('.pdf')]
+            image_paths = [path for filename, path in saved_files if filename.endswith(('.png', '.jpg', '.jpeg'))]
+            # 音檔功能尚未實現 (.mp3)
+
+            all_texts = []
+            if pdf_paths:
+                all_texts.extend(extract_texts_from_pdfs(pdf_paths))
+            if image_paths:
+                all_texts.extend(extract_texts_from_images(image_paths))
+
+        job.start_stage("retrieve")
+        with span("stage_retrieve"):
+            retriever = initialize_retriever()
 
-    if not os.path.exists(UPLOAD_FOLDER):
-        os.makedirs(UPLOAD_FOLDER)
+        job.start_stage("generate")
+        with span("stage_generate"):
+            job.set_questions(expand_questions(questions_prompts, company_name))
+            on_token = job.token_received if stream_tokens else None
+            report = generate_report(all_texts, company_name, retriever, on_answer=job.answer_done, on_token=on_token)
 
-    if not os.path.exists(REPORT_FOLDER):
-        os.makedirs(REPORT_FOLDER)
+        job.start_stage("render")
+        with span("stage_render"):
+            data = {
+                'report': report,
+                'company_name': company_name
+            }
+            file_path = save_to_pdf1(data, report_store.job_dir(job.id))
 
-    all_texts = []
-    for file in files:
-        unique_filename = f"{uuid.uuid4().hex}.pdf"
-        temp_file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(temp_file_path)
+        trace.write_summary(file_path, job_id=job.id, company_name=company_name, files=len(saved_files))
 
-        if file.filename.endswith('.pdf'):
-            text = extract_texts_from_pdfs([temp_file_path])
+    return f"/download/{job.id}/{os.path.basename(file_path)}"
 
-        elif file.filename.endswith(('.png', '.jpg', '.jpeg')):
-            text = extract_text_from_image(temp_file_path)
-        elif file.filename.endswith('.mp3'):
-            pass # 音檔功能尚未實現
-            # text = extract_text_from_audio(temp_file_path)
-        else:
-            continue
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.to_dict())
 
-        all_texts.extend(text)
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return event_stream_response(job)
 
-    retriever = initialize_retriever()
-    report = generate_report('\n'.join(all_texts), company_name, retriever)
+@app.route('/upload/stream', methods=['POST'])
+def model_response_stream():
+    # 和 /upload 相同，但直接以 SSE 回傳每一題產生好的答案
+    job = submit_upload()
+    return event_stream_response(job)
 
-    data = {
-        'report': report,
-        'company_name': company_name
-    }
-    file_path = save_to_pdf1(data, REPORT_FOLDER)
+def event_stream_response(job):
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(sse_stream(job), mimetype="text/event-stream", headers=headers)
 
-    return jsonify({"download_link": f"/download/{os.path.basename(file_path)}"})
+@app.route('/ready', methods=['GET'])
+def ready():
+    status = get_warm_index().status()
+    return jsonify(status), 200 if status["ready"] else 503
 
-@app.route('/download/<filename>', methods=['GET'])
-def download_file(filename):
-    file_path = os.path.join(REPORT_FOLDER, filename)
-    if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True)
+@app.route('/download/<job_id>/<filename>', methods=['GET'])
+def download_file(job_id, filename):
+    # send_from_directory 會擋掉目錄外的路徑、找不到檔案時回 404，並處理 ETag / If-None-Match (304) 與 Range 續傳，
+    # 檔案內容由 wsgi.file_wrapper (或 X-Sendfile) 直接傳送，不經過 Python 逐塊讀取
+    response = send_from_directory(report_store.root, f"{job_id}/{filename}", as_attachment=True,
+                                   conditional=True, etag=True, max_age=REPORT_MAX_AGE)
+    # 報告只給上傳的使用者，不讓共用的 proxy 快取 (send_from_directory 預設會加上 public)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
 
 if __name__ == "__main__":
+    # debug reloader 的父 process 只負責監看檔案，實際處理請求的子 process 才啟動背景服務
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services()
     app.run(debug=True, host="127.0.0.1", port=5000)
@@ -0,0 +1,131 @@
+import os
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+
+# 上傳檔案與產生的報告依工作分目錄存放 (<root>/<job_id>/...)，超過保存時間或總大小上限時從最舊的目錄開始刪除
+# 寫入都先寫到 .part 暫存檔再 rename，讀取端 (下載、ChatBot 建索引) 不會看到寫到一半的檔案
+
+PARTIAL_SUFFIX = ".part"
+
+
+def get_artifact_ttl():
+    return float(os.getenv("ARTIFACT_TTL", "86400"))
+
+
+def get_artifact_max_bytes():
+    return int(float(os.getenv("ARTIFACT_MAX_MB", "2048")) * 1024 * 1024)
+
+
+def get_cleanup_interval():
+    return float(os.getenv("ARTIFACT_CLEANUP_INTERVAL", "300"))
+
+
+@contextmanager
+def atomic_path(path):
+    # with atomic_path(path) as tmp_path: 寫入 tmp_path，成功後才換成 path，失敗則刪除暫存檔
+    tmp_path = f"{path}{PARTIAL_SUFFIX}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _directory_size(path):
+    total = 0
+    for directory, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(directory, filename))
+            except OSError:
+                pass
+    return total
+
+
+class ArtifactStore:
+    def __init__(self, root, ttl=None, max_bytes=None):
+        self.root = os.path.abspath(root)
+        self.ttl = ttl if ttl is not None else get_artifact_ttl()
+        self.max_bytes = max_bytes if max_bytes is not None else get_artifact_max_bytes()
+        self._pinned = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def job_dir(self, job_id):
+        path = os.path.join(self.root, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def save_upload(self, job_id, file, filename):
+        # file 是 werkzeug 的 FileStorage
+        path = os.path.join(self.job_dir(job_id), filename)
+        with atomic_path(path) as tmp_path:
+            file.save(tmp_path)
+        return path
+
+    def pin(self, job_id):
+        # 還在排隊或執行中的工作不能被清掉
+        with self._lock:
+            self._pinned[job_id] = self._pinned.get(job_id, 0) + 1
+
+    def unpin(self, job_id):
+        with self._lock:
+            count = self._pinned.get(job_id, 0) - 1
+            if count > 0:
+                self._pinned[job_id] = count
+            else:
+                self._pinned.pop(job_id, None)
+
+    @contextmanager
+    def released(self, job_id):
+        # 搭配 submit 時的 pin 使用：區塊結束 (成功或失敗) 後才允許清除這個工作的目錄
+        try:
+            yield
+        finally:
+            self.unpin(job_id)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                entries.append((os.path.getmtime(path), name, path, _directory_size(path)))
+        return sorted(entries)
+
+    def cleanup(self, now=None):
+        # 先刪掉過期的目錄，總大小仍超過上限時再從最舊的開始刪；回傳刪除的目錄數
+        now = now or time.time()
+        removed = 0
+        entries = self._entries()
+        total = sum(size for _, _, _, size in entries)
+        for mtime, name, path, size in entries:
+            if now - mtime > self.ttl or total > self.max_bytes:
+                # 每個目錄在刪除前才檢查是否被 pin，檢查與刪除之間 pin() 會等待，不會刪到剛開始的工作
+                with self._lock:
+                    if name in self._pinned:
+                        continue
+                    shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                removed += 1
+        if removed:
+            print(f"Artifact store {self.root}: removed {removed} job directories, {total / 1024 / 1024:.1f} MB left")
+        return removed
+
+    def start_cleanup(self, interval=None):
+        interval = interval or get_cleanup_interval()
+
+        def run():
+            while True:
+                try:
+                    self.cleanup()
+                except Exception as e:
+                    print(f"Artifact cleanup failed: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, daemon=True, name="artifact-cleanup")
+        thread.start()
+        return thread
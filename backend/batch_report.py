@@ -0,0 +1,180 @@
+import os
+import csv
+import json
+import time
+import argparse
+import importlib
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from tracing import Trace, job_trace, span
+
+# 批次產生報告：讀取公司清單 (manifest)，知識庫索引、embedding model 與 LLM client 只載入一次，
+# 多家公司在 worker pool 中同時產生；每完成一家就寫入 checkpoint，中斷後重新執行會跳過已完成的公司
+# 後端模組使用相對路徑 (./font、./faiss_index ...)，需要在 backend/ 下執行：
+# python batch_report.py companies.csv --variant openai --workers 4
+
+CHECKPOINT_FILENAME = "checkpoint.jsonl"
+PDF_EXTENSIONS = ('.pdf',)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def load_manifest(path):
+    # CSV (company_name,documents 欄位) 或 JSON ([{"company_name": ..., "documents": ...}])，
+    # documents 為相對路徑時以 manifest 所在目錄為基準
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    base = os.path.dirname(os.path.abspath(path))
+    companies = []
+    for row in rows:
+        company_name = (row.get("company_name") or "").strip()
+        documents = (row.get("documents") or "").strip()
+        if not company_name or not documents:
+            raise ValueError(f"Manifest row needs company_name and documents: {row}")
+        companies.append({"company_name": company_name, "documents": os.path.normpath(os.path.join(base, documents))})
+    return companies
+
+
+def checkpoint_key(company):
+    return f"{company['company_name']}\t{company['documents']}"
+
+
+class Checkpoint:
+    # 每家公司完成 (或失敗) 時追加一行 JSON，寫入後立即 fsync，process 被中斷也只會遺失還在產生中的公司
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, CHECKPOINT_FILENAME)
+        self.done = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 最後一行可能只寫了一半
+                        continue
+                    if entry.get("status") == "done" and os.path.exists(entry.get("file_path", "")):
+                        self.done[entry["key"]] = entry
+
+    def record(self, entry):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if entry["status"] == "done":
+                self.done[entry["key"]] = entry
+
+
+def list_documents(directory):
+    paths = [os.path.join(directory, filename) for filename in sorted(os.listdir(directory))]
+    pdf_paths = [path for path in paths if path.lower().endswith(PDF_EXTENSIONS)]
+    image_paths = [path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS)]
+    return pdf_paths, image_paths
+
+
+def build_company_report(utils, retriever, company, output_dir):
+    trace = Trace()
+    with job_trace(trace):
+        with span("stage_extract"):
+            pdf_paths, image_paths = list_documents(company["documents"])
+            all_texts = []
+            if pdf_paths:
+                all_texts.extend(utils.extract_texts_from_pdfs(pdf_paths))
+            if image_paths:
+                all_texts.extend(utils.extract_texts_from_images(image_paths))
+
+        with span("stage_generate"):
+            report = utils.generate_report(all_texts, company["company_name"], retriever)
+
+        with span("stage_render"):
+            data = {
+                'report': report,
+                'company_name': company["company_name"]
+            }
+            file_path = utils.save_to_pdf1(data, output_dir)
+
+        trace.write_summary(file_path, company_name=company["company_name"],
+                            files=len(pdf_paths) + len(image_paths))
+    return file_path
+
+
+def run_batch(utils, companies, output_dir, workers):
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint = Checkpoint(output_dir)
+    pending = [company for company in companies if checkpoint_key(company) not in checkpoint.done]
+    skipped = len(companies) - len(pending)
+    if skipped:
+        print(f"Resuming: {skipped} of {len(companies)} companies already done")
+
+    # 整個批次共用同一份索引；LLM client 由 create_llm() 在 process 內共用，generate_report 自行選擇一般或 JSON 輸出的 client
+    retriever = utils.initialize_retriever()
+
+    def run(company):
+        started = time.perf_counter()
+        entry = {"key": checkpoint_key(company), "company_name": company["company_name"],
+                 "documents": company["documents"]}
+        try:
+            entry["file_path"] = build_company_report(utils, retriever, company, output_dir)
+            entry["status"] = "done"
+        except Exception as e:
+            traceback.print_exc()
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+        entry["seconds"] = time.perf_counter() - started
+        entry["finished_at"] = time.time()
+        checkpoint.record(entry)
+        return entry
+
+    started = time.perf_counter()
+    results = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-report") as executor:
+        futures = [executor.submit(run, company) for company in pending]
+        for future in as_completed(futures):
+            entry = future.result()
+            results.append(entry)
+            print(f"[{len(results)}/{len(pending)}] {entry['status']}: {entry['company_name']} "
+                  f"({entry['seconds']:.1f}s)")
+    elapsed = time.perf_counter() - started
+
+    completed = sum(1 for entry in results if entry["status"] == "done")
+    return {
+        "companies": len(companies),
+        "skipped": skipped,
+        "completed": completed,
+        "failed": len(results) - completed,
+        "seconds": elapsed,
+        "reports_per_hour": completed * 3600 / elapsed if elapsed > 0 else 0.0,
+        "workers": workers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", help="CSV (company_name,documents) 或 JSON 格式的公司清單")
+    parser.add_argument("--variant", choices=["openai", "llama"], default="openai")
+    parser.add_argument("--output", default="../batch_reports",
+                        help="報告與 checkpoint 的輸出目錄，重新執行同一個目錄會從中斷處繼續")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("REPORT_WORKERS", "2")),
+                        help="同時產生幾家公司的報告")
+    args = parser.parse_args()
+
+    load_dotenv()
+    utils = importlib.import_module(f"utils_{args.variant}")
+    companies = load_manifest(args.manifest)
+    summary = run_batch(utils, companies, os.path.abspath(args.output), args.workers)
+
+    print(f"{summary['completed']} reports in {summary['seconds']:.1f}s "
+          f"({summary['reports_per_hour']:.1f} reports/hour, {summary['workers']} workers), "
+          f"{summary['failed']} failed, {summary['skipped']} skipped")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
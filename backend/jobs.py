@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+STAGES = ["extract", "retrieve", "generate", "render"]
+
+
+class Job:
+    def __init__(self, trace_id=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.trace_id = trace_id
+        self.status = "queued"
+        self.stage = None
+        self.stages = {name: {"status": "pending", "started_at": None, "finished_at": None} for name in STAGES}
+        self.answered = 0
+        self.total = 0
+        self.download_link = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        # 事件依序編號 (seq)，訂閱者以編號記住讀到哪裡，刪掉已合併的 token 事件不會影響其他事件的位置
+        self.events = []
+        self._next_seq = 0
+        self._question_index = {}
+        self._lock = threading.Condition()
+
+    def _publish(self, event, data):
+        # 呼叫前必須已持有 self._lock
+        self.events.append({"seq": self._next_seq, "event": event, "data": data})
+        self._next_seq += 1
+        self._lock.notify_all()
+
+    def _drop_tokens(self, index=None):
+        # 呼叫前必須已持有 self._lock；答案事件已包含完整答案，逐字的 token 事件不必再保留
+        self.events = [event for event in self.events
+                       if event["event"] != "token" or (index is not None and event["data"]["index"] != index)]
+
+    def start_stage(self, name):
+        with self._lock:
+            now = time.time()
+            if self.stage is not None and self.stages[self.stage]["status"] == "running":
+                self.stages[self.stage].update(status="done", finished_at=now)
+            self.stage = name
+            self.stages[name].update(status="running", started_at=now)
+            self._publish("stage", {"stage": name})
+
+    def set_questions(self, questions):
+        # questions 是 (章節, 問題) 的列表，順序即報告順序
+        with self._lock:
+            self.total = len(questions)
+            self._question_index = {question: index for index, (_, question) in enumerate(questions)}
+            self._publish("questions", [{"index": index, "section": section, "question": question}
+                                        for index, (section, question) in enumerate(questions)])
+
+    def answer_done(self, index, question, answer):
+        with self._lock:
+            self.answered += 1
+            self._drop_tokens(index)
+            self._publish("answer", {"index": index, "question": question, "answer": answer})
+
+    def token_received(self, question, token):
+        with self._lock:
+            self._publish("token", {"index": self._question_index.get(question), "token": token})
+
+    def finish(self, download_link):
+        with self._lock:
+            now = time.time()
+            if self.stage is not None:
+                self.stages[self.stage].update(status="done", finished_at=now)
+            self.status = "done"
+            self.download_link = download_link
+            self.finished_at = now
+            self._drop_tokens()
+            self._publish("done", {"download_link": download_link})
+
+    def fail(self, error):
+        with self._lock:
+            now = time.time()
+            if self.stage is not None:
+                self.stages[self.stage].update(status="failed", finished_at=now)
+            self.status = "failed"
+            self.error = error
+            self.finished_at = now
+            self._drop_tokens()
+            self._publish("error", {"error": error})
+
+    def wait_events(self, start, timeout=None):
+        # 回傳 (編號 >= start 的事件, 下一次的 start, 是否已結束)
+        with self._lock:
+            self._lock.wait_for(lambda: self._next_seq > start or self.finished_at is not None, timeout)
+            first = len(self.events)
+            while first > 0 and self.events[first - 1]["seq"] >= start:
+                first -= 1
+            return self.events[first:], self._next_seq, self.finished_at is not None
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "trace_id": self.trace_id,
+                "status": self.status,
+                "stage": self.stage,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "progress": {"answered": self.answered, "total": self.total},
+                "download_link": self.download_link,
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobQueue:
+    def __init__(self, max_workers=None, max_jobs=None):
+        max_workers = max_workers or int(os.getenv("REPORT_WORKERS", "2"))
+        self.max_jobs = max_jobs or int(os.getenv("REPORT_MAX_JOBS", "200"))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        # 只保留最近的 max_jobs 筆，已結束的工作優先清掉
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        while len(self._jobs) > self.max_jobs and finished:
+            self._jobs.pop(finished.pop(0), None)
+
+    def _run(self, job, fn, args):
+        job.status = "running"
+        try:
+            download_link = fn(job, *args)
+            job.finish(download_link)
+        except Exception as e:
+            traceback.print_exc()
+            job.fail(str(e))
+
+    def submit(self, fn, *args, trace_id=None, job_id=None):
+        # fn(job, *args) 在背景執行，回傳下載連結
+        job = Job(trace_id, job_id)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+def sse_stream(job, keep_alive=15):
+    # 以 Server-Sent Events 格式依序送出 job 的事件，job 結束後關閉
+    start = 0
+    while True:
+        events, start, finished = job.wait_events(start, timeout=keep_alive)
+        for event in events:
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+        if finished and not events:
+            return
+        if not events:
+            yield ": keep-alive\n\n"
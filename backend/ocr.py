@@ -0,0 +1,176 @@
+import io
+import os
+import time
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pytesseract
+from PIL import Image
+from tracing import record_span
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ocr_lang():
+    return os.getenv("OCR_LANG", "chi_tra+eng")
+
+
+def get_ocr_workers():
+    return int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+
+
+def get_max_width():
+    # 約等於 A4 寬度在 300 DPI 下的像素，再大對 Tesseract 沒有幫助只會變慢
+    return int(os.getenv("OCR_MAX_WIDTH", "2480"))
+
+
+def get_tile_height():
+    return int(os.getenv("OCR_TILE_HEIGHT", "3508"))
+
+
+def pdf_ocr_enabled():
+    return os.getenv("PDF_OCR_FALLBACK", "true").lower() == "true"
+
+
+def _get_pool(max_workers):
+    # 第一次批次 OCR 時才建立，import 這個模組不會啟動任何 process
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers)
+        return _pool
+
+
+def _discard_pool(pool):
+    # worker 異常結束 (例如被系統終止) 後整個 pool 都無法再使用，下次呼叫時重新建立
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _submit_sources(max_workers, sources, lang):
+    pool = _get_pool(max_workers)
+    try:
+        return pool, [pool.submit(_ocr_source, source, lang) for source in sources]
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        pool = _get_pool(max_workers)
+        return pool, [pool.submit(_ocr_source, source, lang) for source in sources]
+
+
+def _otsu_threshold(image):
+    histogram = image.histogram()
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background, weight_background = 0, 0
+    best_threshold, best_variance = 127, 0.0
+    for i, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += i * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = i, variance
+    return best_threshold
+
+
+def preprocess_image(image, max_width=None):
+    # 灰階 → 縮小到 OCR 需要的解析度 → Otsu 二值化
+    max_width = max_width or get_max_width()
+    image = image.convert("L")
+    if image.width > max_width:
+        height = max(1, round(image.height * max_width / image.width))
+        image = image.resize((max_width, height), Image.LANCZOS)
+    threshold = _otsu_threshold(image)
+    return image.point(lambda p: 255 if p > threshold else 0, mode="1")
+
+
+def tile_image(image, tile_height=None, overlap=64):
+    # 很長的圖片 (例如整頁截圖) 切成上下重疊的幾塊，避免 Tesseract 處理超大圖
+    tile_height = tile_height or get_tile_height()
+    if image.height <= tile_height:
+        return [image]
+    tiles = []
+    top = 0
+    while top < image.height:
+        bottom = min(top + tile_height, image.height)
+        tiles.append(image.crop((0, top, image.width, bottom)))
+        if bottom == image.height:
+            break
+        top = bottom - overlap
+    return tiles
+
+
+def ocr_image(image, lang=None):
+    lang = lang or get_ocr_lang()
+    image = preprocess_image(image)
+    texts = [pytesseract.image_to_string(tile, lang=lang) for tile in tile_image(image)]
+    return "\n".join(text.strip() for text in texts if text.strip())
+
+
+def _ocr_source(source, lang):
+    # source 可以是檔案路徑或圖片的 bytes (例如從 PDF 頁面取出的掃描影像)
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        return ocr_image(image, lang)
+
+
+def ocr_pdf_page(page, lang=None):
+    # 沒有文字層的 PDF 頁面通常是一張 (或數張) 掃描影像，逐一 OCR
+    texts = []
+    for image_file in page.images:
+        try:
+            text = _ocr_source(image_file.data, lang)
+        except Exception:
+            traceback.print_exc()
+            continue
+        if text:
+            texts.append(text)
+    return "\n".join(texts)
+
+
+def ocr_images(sources, lang=None, max_workers=None):
+    # 批次 OCR，依照輸入順序回傳文字；單張失敗回傳空字串
+    lang = lang or get_ocr_lang()
+    max_workers = max_workers if max_workers is not None else get_ocr_workers()
+    started = time.perf_counter()
+
+    if max_workers <= 1 or len(sources) <= 1:
+        pool = futures = None
+    else:
+        pool, futures = _submit_sources(max_workers, sources, lang)
+
+    texts = []
+    resubmitted = False
+    for i, source in enumerate(sources):
+        try:
+            try:
+                texts.append(futures[i].result() if futures else _ocr_source(source, lang))
+            except BrokenProcessPool:
+                # pool 壞掉時尚未取得結果的圖片全部會失敗，換一個新的 pool 重新送出一次
+                _discard_pool(pool)
+                if resubmitted:
+                    raise
+                resubmitted = True
+                pool, futures[i:] = _submit_sources(max_workers, sources[i:], lang)
+                texts.append(futures[i].result())
+        except Exception:
+            traceback.print_exc()
+            texts.append("")
+
+    elapsed = time.perf_counter() - started
+    pages_per_minute = len(sources) * 60 / elapsed if elapsed > 0 else 0.0
+    record_span("ocr", started, elapsed, images=len(sources), lang=lang)
+    print(f"OCR {len(sources)} images in {elapsed:.2f}s ({pages_per_minute:.1f} pages/min, lang={lang})")
+    return texts
@@ -0,0 +1,150 @@
+import os
+import time
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import sys
+from pypdf import PdfReader
+from langchain_core.documents import Document
+from ocr import ocr_pdf_page, pdf_ocr_enabled
+from tracing import record_span
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.chunker import get_chunker
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_extract_workers():
+    return int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+
+
+def get_pages_per_task():
+    return max(1, int(os.getenv("PDF_PAGES_PER_TASK", "16")))
+
+
+def _get_pool(max_workers):
+    # process pool 建立成本高，整個 process 共用一個；第一次抽取時才建立，import 這個模組不會啟動任何 process
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers)
+        return _pool
+
+
+def _discard_pool(pool):
+    # worker 異常結束 (例如被系統終止) 後整個 pool 都無法再使用，下次呼叫時重新建立
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _submit_tasks(max_workers, tasks, ocr_fallback):
+    pool = _get_pool(max_workers)
+    try:
+        return pool, [pool.submit(_extract_range, *task, ocr_fallback) for task in tasks]
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        pool = _get_pool(max_workers)
+        return pool, [pool.submit(_extract_range, *task, ocr_fallback) for task in tasks]
+
+
+def _extract_range(file_path, start, end, ocr_fallback=True):
+    # 每頁各自切段 (切法由 CHUNKER 決定，預設與 PyPDFLoader.load_and_split() 相同)
+    # 沒有文字層的掃描頁面改用 OCR，回傳 ([(段落, metadata)], OCR 頁數)
+    reader = PdfReader(file_path)
+    chunker = get_chunker()
+    chunks = []
+    ocr_pages = 0
+    for page_number, page in enumerate(reader.pages[start:end], start):
+        text = page.extract_text() or ""
+        if not text.strip() and ocr_fallback:
+            text = ocr_pdf_page(page)
+            ocr_pages += 1
+        chunks.extend(chunker.split_page(text, {"source": os.path.basename(file_path), "page": page_number}))
+    return chunks, ocr_pages
+
+
+def _count_pages(file_path):
+    return len(PdfReader(file_path).pages)
+
+
+def extract_pdfs(file_paths, max_workers=None, pages_per_task=None):
+    # 回傳 (文字列表, 統計資訊)
+    documents, stats = extract_pdf_documents(file_paths, max_workers, pages_per_task)
+    return [document.page_content for document in documents], stats
+
+
+def extract_pdf_documents(file_paths, max_workers=None, pages_per_task=None):
+    # 依檔案與頁數範圍切成多個工作平行抽取，結果維持原本的檔案與頁面順序
+    # 單一檔案失敗只會略過該檔案，回傳 (帶 source / page metadata 的 Document 列表, 統計資訊)
+    max_workers = max_workers if max_workers is not None else get_extract_workers()
+    pages_per_task = pages_per_task or get_pages_per_task()
+    started = time.perf_counter()
+
+    ocr_fallback = pdf_ocr_enabled()
+    tasks = []
+    failed = {}
+    for file_path in file_paths:
+        try:
+            page_count = _count_pages(file_path)
+        except Exception as e:
+            failed[file_path] = str(e)
+            continue
+        for start in range(0, page_count, pages_per_task):
+            tasks.append((file_path, start, min(start + pages_per_task, page_count)))
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        pool = futures = None
+    else:
+        pool, futures = _submit_tasks(max_workers, tasks, ocr_fallback)
+
+    results = {}
+    resubmitted = False
+    for i, task in enumerate(tasks):
+        file_path = task[0]
+        if file_path in failed:
+            continue
+        try:
+            try:
+                results[i] = futures[i].result() if futures else _extract_range(*task, ocr_fallback)
+            except BrokenProcessPool:
+                # pool 壞掉時尚未取得結果的工作全部會失敗，換一個新的 pool 重新送出一次
+                _discard_pool(pool)
+                if resubmitted:
+                    raise
+                resubmitted = True
+                pool, futures[i:] = _submit_tasks(max_workers, tasks[i:], ocr_fallback)
+                results[i] = futures[i].result()
+        except Exception as e:
+            traceback.print_exc()
+            failed[file_path] = str(e)
+
+    documents = []
+    total_pages = 0
+    ocr_pages = 0
+    for i, (file_path, start, end) in enumerate(tasks):
+        if file_path not in failed:
+            chunks, task_ocr_pages = results[i]
+            documents.extend(Document(page_content=text, metadata=metadata) for text, metadata in chunks)
+            total_pages += end - start
+            ocr_pages += task_ocr_pages
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "files": len(file_paths),
+        "pages": total_pages,
+        "seconds": elapsed,
+        "pages_per_second": total_pages / elapsed if elapsed > 0 else 0.0,
+        "ocr_pages": ocr_pages,
+        "failed": failed,
+    }
+    record_span("pdf_extract", started, elapsed, files=len(file_paths), pages=total_pages, ocr_pages=ocr_pages,
+                failed=len(failed))
+    print(f"Extracted {total_pages} pages from {len(file_paths)} files in {elapsed:.2f}s "
+          f"({stats['pages_per_second']:.1f} pages/s, {ocr_pages} OCR pages, {len(failed)} failed)")
+    return documents, stats
@@ -0,0 +1,217 @@
+import os
+import html
+import time
+import uuid
+import threading
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, PageBreak
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from tracing import record_span
+from artifact_store import atomic_path
+
+# 報告輸出：PDF 在專用的 worker process 中產生 (字型與樣式在 worker 啟動時載入一次)，
+# 另外提供不需要排版的 HTML / Markdown 輸出
+
+FORMATS = {"pdf": "pdf", "html": "html", "markdown": "md"}
+
+_pool = None
+_pool_lock = threading.Lock()
+_styles = {}
+
+
+def get_report_format():
+    return os.getenv("REPORT_FORMAT", "pdf")
+
+
+def get_render_workers():
+    return int(os.getenv("RENDER_WORKERS", "2"))
+
+
+def _load_styles(font_path=None):
+    # 每個 process 對同一個字型只註冊一次，樣式也只建立一次
+    if font_path in _styles:
+        return _styles[font_path]
+
+    styles = getSampleStyleSheet()
+    font_name = None
+    if font_path:
+        font_name = os.path.splitext(os.path.basename(font_path))[0]
+        pdfmetrics.registerFont(TTFont(font_name, font_path))
+
+    def styled(name, parent, **kwargs):
+        if font_name:
+            kwargs["fontName"] = font_name
+        return ParagraphStyle(name=name, parent=styles[parent], **kwargs)
+
+    title = ParagraphStyle(name="ReportTitle", parent=styles["Title"], alignment=1, spaceAfter=24)
+    _styles[font_path] = {
+        "title": title,
+        "heading": styled("ReportQuestion", "Heading2", spaceBefore=12, spaceAfter=12),
+        "body": styled("ReportAnswer", "BodyText", spaceAfter=12),
+        "meta": ParagraphStyle(name="ReportMeta", parent=styles["BodyText"], spaceAfter=12),
+        "meta_cjk": styled("ReportMetaCJK", "BodyText", spaceAfter=12),
+    }
+    return _styles[font_path]
+
+
+def parse_report(report):
+    # "Question: ...\nAnswer: ...\n\n" 的報告文字拆成 [(問題, [答案的每一行])]，不是 Question 開頭的行都併入前一題的答案
+    entries = []
+    for line in report.split("\n"):
+        if line.startswith("Question:"):
+            entries.append((line, []))
+        elif line.strip():
+            if not entries:
+                entries.append((None, []))
+            entries[-1][1].append(line)
+    return entries
+
+
+def _draw_footer(canvas, doc):
+    canvas.saveState()
+    canvas.setFont("Helvetica", 10)
+    canvas.drawString(doc.leftMargin, doc.bottomMargin / 2, "Credit Analysis Report - %d " % doc.page)
+    canvas.restoreState()
+
+
+def _render_pdf(report, company_name, report_date, file_path, font_path=None):
+    styles = _load_styles(font_path)
+    story = [
+        Paragraph("Credit Analysis Report", styles["title"]),
+        Paragraph(f"Company Name: {escape(company_name)}", styles["meta_cjk"]),
+        Paragraph(f"Report Date: {report_date}", styles["meta"]),
+        PageBreak(),
+    ]
+
+    # 每題只產生兩個 Paragraph (問題、整段答案)，間距由樣式的 spaceBefore / spaceAfter 處理
+    for question, answer_lines in parse_report(report):
+        if question is not None:
+            story.append(Paragraph(escape(question), styles["heading"]))
+        if answer_lines:
+            story.append(Paragraph("<br/>".join(escape(line) for line in answer_lines), styles["body"]))
+
+    doc = SimpleDocTemplate(file_path, pagesize=letter)
+    doc.build(story, onLaterPages=_draw_footer)
+    return file_path
+
+
+def _render_html(report, company_name, report_date, file_path):
+    parts = [
+        "<!DOCTYPE html>",
+        '<html lang="zh-Hant"><head><meta charset="utf-8"><title>Credit Analysis Report</title>',
+        "<style>body{font-family:sans-serif;max-width:50em;margin:2em auto;line-height:1.6}"
+        "h2{font-size:1.1em;margin-top:1.5em}</style></head><body>",
+        "<h1>Credit Analysis Report</h1>",
+        f"<p>Company Name: {html.escape(company_name)}</p>",
+        f"<p>Report Date: {report_date}</p>",
+    ]
+    for question, answer_lines in parse_report(report):
+        if question is not None:
+            parts.append(f"<h2>{html.escape(question)}</h2>")
+        if answer_lines:
+            parts.append(f"<p>{'<br>'.join(html.escape(line) for line in answer_lines)}</p>")
+    parts.append("</body></html>")
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(parts))
+    return file_path
+
+
+def _render_markdown(report, company_name, report_date, file_path):
+    parts = [
+        "# Credit Analysis Report",
+        "",
+        f"Company Name: {company_name}  ",
+        f"Report Date: {report_date}",
+        "",
+    ]
+    for question, answer_lines in parse_report(report):
+        if question is not None:
+            parts.extend([f"## {question}", ""])
+        if answer_lines:
+            parts.extend(["  \n".join(answer_lines), ""])
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(parts))
+    return file_path
+
+
+def _init_worker(font_path):
+    # 字型載入失敗時不要讓整個 pool 壞掉，實際產生報告時會再丟出錯誤
+    try:
+        _load_styles(font_path)
+    except Exception as e:
+        print(f"Report renderer failed to preload font {font_path}: {e}")
+
+
+def _get_pool(font_path):
+    # worker 啟動時就先載入字型與樣式，第一份報告不用等
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=get_render_workers(), initializer=_init_worker,
+                                        initargs=(font_path,))
+        return _pool
+
+
+def _discard_pool(pool):
+    # worker 異常結束後整個 pool 都無法再使用，下次呼叫時重新建立
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _run_in_pool(font_path, fn, *args):
+    # pool 壞掉 (例如 worker 被系統終止) 時換一個新的 pool 重試一次
+    pool = _get_pool(font_path)
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        return _get_pool(font_path).submit(fn, *args).result()
+
+
+def warm_up(font_path=None):
+    # 在服務啟動時呼叫，先建立 worker process 並載入字型
+    if get_render_workers() > 0:
+        font_path = os.path.abspath(font_path) if font_path else None
+        pool = _get_pool(font_path)
+        # process 在第一次 submit 時才會啟動
+        try:
+            for _ in range(get_render_workers()):
+                pool.submit(_init_worker, font_path)
+        except BrokenProcessPool:
+            _discard_pool(pool)
+
+
+def render_report(data, directory, fmt=None, font_path=None):
+    # data 與 save_to_pdf1 相同 ({'report', 'company_name'})，回傳輸出檔案的路徑
+    fmt = fmt or get_report_format()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown report format: {fmt} (expected one of {', '.join(FORMATS)})")
+    file_path = os.path.join(directory, f"report_{uuid.uuid4().hex}.{FORMATS[fmt]}")
+    report_date = date.today().strftime('%Y-%m-%d')
+    font_path = os.path.abspath(font_path) if font_path else None
+    started = time.perf_counter()
+
+    # 先寫到暫存檔，完成後才出現在下載目錄
+    with atomic_path(file_path) as tmp_path:
+        if fmt == "html":
+            _render_html(data['report'], data['company_name'], report_date, tmp_path)
+        elif fmt == "markdown":
+            _render_markdown(data['report'], data['company_name'], report_date, tmp_path)
+        elif get_render_workers() > 0:
+            # 排版在 worker process 中進行，不會和其他報告的執行緒搶 GIL
+            _run_in_pool(font_path, _render_pdf, data['report'], data['company_name'], report_date, tmp_path,
+                         font_path)
+        else:
+            _render_pdf(data['report'], data['company_name'], report_date, tmp_path, font_path)
+
+    record_span("render_report", started, time.perf_counter() - started, format=fmt)
+    return file_path
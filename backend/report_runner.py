@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import asyncio
+import traceback
+
+from langchain_core.prompts import PromptTemplate
+from upload_index import UploadIndex
+from tracing import span, record_llm_usage
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.answer_cache import get_answer_cache, hash_text
+from common.context_packer import ContextPacker, interleave
+from common.llm_provider import call_deadline
+
+TIMEOUT_ANSWER = "回答逾時，請稍後重新產生報告或自行查看文件內容。"
+ERROR_ANSWER = "回答失敗，請稍後重新產生報告或自行查看文件內容。"
+
+
+def get_max_concurrency():
+    return max(1, int(os.getenv("REPORT_MAX_CONCURRENCY", "4")))
+
+
+def get_question_timeout():
+    timeout = float(os.getenv("REPORT_QUESTION_TIMEOUT", "120"))
+    return timeout if timeout > 0 else None
+
+
+def get_prompt_mode():
+    # question：每題各呼叫一次 LLM；section：同一章節的問題一起送出，要求以 JSON 回答
+    return os.getenv("REPORT_PROMPT_MODE", "question")
+
+
+def expand_questions(questions_prompts, company_name):
+    # 依照章節順序展開所有問題，回傳 (章節, 問題) 的列表
+    questions = []
+    for section, question_templates in questions_prompts.items():
+        for question_template in question_templates:
+            questions.append((section, question_template.format(company_name=company_name)))
+    return questions
+
+
+async def _answer_one(semaphore, index, question, answer_fn, timeout, on_result):
+    # wait_for 逾時只會取消等待，LLM 呼叫在 thread 中執行、無法中斷，所以同時把期限交給 LLM client：
+    # 期限到了不再重試，HTTP 請求的 timeout 也不超過期限，逾時的呼叫不會在背景繼續佔用名額
+    async with semaphore:
+        try:
+            with call_deadline(timeout):
+                answer = await asyncio.wait_for(answer_fn(question), timeout)
+        except asyncio.TimeoutError:
+            print(f"Question timed out after {timeout}s: {question}")
+            answer = TIMEOUT_ANSWER
+        except Exception:
+            # 單一題目失敗不影響整份報告
+            traceback.print_exc()
+            answer = ERROR_ANSWER
+    if on_result is not None:
+        on_result(index, question, answer)
+    return answer
+
+
+async def _run_all(questions, answer_fn, max_concurrency, timeout, on_result):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    return await asyncio.gather(*(
+        _answer_one(semaphore, index, question, answer_fn, timeout, on_result)
+        for index, question in enumerate(questions)
+    ))
+
+
+def run_questions(questions, answer_fn, max_concurrency=None, timeout=None, on_result=None):
+    # answer_fn 是 async 函式；同時最多 max_concurrency 個問題在跑，回傳的答案順序與 questions 相同
+    # on_result(index, question, answer) 會在每個問題完成時呼叫 (完成順序不一定等於問題順序)
+    max_concurrency = max_concurrency or get_max_concurrency()
+    timeout = timeout if timeout is not None else get_question_timeout()
+    return asyncio.run(_run_all(questions, answer_fn, max_concurrency, timeout, on_result))
+
+
+def group_sections(questions):
+    # (章節, 問題) 的列表依章節分組，回傳 [(章節, [問題...]), ...]，順序不變
+    sections = []
+    for section, question in questions:
+        if not sections or sections[-1][0] != section:
+            sections.append((section, []))
+        sections[-1][1].append(question)
+    return sections
+
+
+def number_questions(questions):
+    return "\n".join(f"{i}. {question}" for i, question in enumerate(questions, 1))
+
+
+def parse_section_answers(text, count):
+    # 解析 {"1": "答案", "2": "答案", ...}；缺少或格式不對的題目回傳 None，由呼叫端逐題重問
+    # 從第一個能解析的 { 開始讀一個完整的 JSON 物件，前後的說明文字 (即使含有大括號) 都略過
+    text = text or ""
+    decoder = json.JSONDecoder()
+    data = None
+    start = text.find("{")
+    while start != -1:
+        try:
+            data, _ = decoder.raw_decode(text, start)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            break
+        start = text.find("{", start + 1)
+    if not isinstance(data, dict):
+        return [None] * count
+
+    answers = []
+    for i in range(1, count + 1):
+        answer = data.get(str(i))
+        if isinstance(answer, (int, float)) and not isinstance(answer, bool):
+            answer = str(answer)
+        answers.append(answer.strip() if isinstance(answer, str) and answer.strip() else None)
+    return answers
+
+
+async def _run_sections(sections, section_fn, answer_fn, max_concurrency, timeout, on_result):
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(offset, questions):
+        async with semaphore:
+            try:
+                # 一次回答整個章節，逾時上限依題數放大
+                section_timeout = timeout and timeout * len(questions)
+                with call_deadline(section_timeout):
+                    answers = await asyncio.wait_for(section_fn(questions), section_timeout)
+            except asyncio.TimeoutError:
+                print(f"Section timed out, falling back to per-question calls: {questions[0]}")
+                answers = [None] * len(questions)
+            except Exception:
+                traceback.print_exc()
+                print(f"Section failed, falling back to per-question calls: {questions[0]}")
+                answers = [None] * len(questions)
+
+        missing = [i for i, answer in enumerate(answers) if answer is None]
+        if missing:
+            print(f"{len(missing)}/{len(questions)} section answers could not be parsed, asking them one by one")
+        for i, answer in enumerate(answers):
+            if answer is not None and on_result is not None:
+                on_result(offset + i, questions[i], answer)
+
+        fallback = await asyncio.gather(*(
+            _answer_one(semaphore, offset + i, questions[i], answer_fn, timeout, on_result) for i in missing
+        ))
+        for i, answer in zip(missing, fallback):
+            answers[i] = answer
+        return answers
+
+    offsets = []
+    offset = 0
+    for questions in sections:
+        offsets.append(offset)
+        offset += len(questions)
+    results = await asyncio.gather(*(run(offset, questions) for offset, questions in zip(offsets, sections)))
+    return [answer for answers in results for answer in answers]
+
+
+def run_sections(sections, section_fn, answer_fn, max_concurrency=None, timeout=None, on_result=None):
+    # sections 是每個章節的問題列表；section_fn(questions) 回傳與 questions 等長的答案列表，
+    # 其中 None 代表該題解析失敗，會改用 answer_fn(question) 單獨回答。回傳的答案依原本的問題順序展開
+    max_concurrency = max_concurrency or get_max_concurrency()
+    timeout = timeout if timeout is not None else get_question_timeout()
+    return asyncio.run(_run_sections(sections, section_fn, answer_fn, max_concurrency, timeout, on_result))
+
+
+def run_report(context, company_name, retriever, embeddings, create_llm, prompt_template, section_prompt_template,
+               questions_prompts, max_concurrency=None, timeout=None, on_answer=None, on_token=None, prompt_mode=None):
+    # openai / llama 兩個版本共用的報告流程：一次檢索所有問題，逐題 (或依章節) 打包 context、查回答快取、呼叫 LLM
+    # create_llm(json_output=False) 與三個 prompt 參數由各版本的 utils 提供
+    report = []
+    if isinstance(context, str):
+        context = [context]
+    upload_index = UploadIndex(context, embeddings)
+    llm = create_llm()
+    prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
+    answer_cache = get_answer_cache()
+    template_version = hash_text(prompt_template)[:12]
+    packer = ContextPacker(llm.model_name)
+
+    async def answer(question):
+        context_from_rag = [result.page_content for result in rag_by_question[question]]
+        context_from_upload = upload_by_question[question]
+
+        # 上傳內容與知識庫的段落輪流排入，去掉重複的段落後截到 token 預算內 (知識庫沒有結果時只用上傳內容)
+        chunks = packer.pack(interleave(context_from_upload, context_from_rag), packer.available(prompt_template, question))
+        full_context = "\n".join(chunks)
+
+        formatted_prompt = prompt.format(context=full_context, question=question)
+
+        # 相同模型、prompt 版本與檢索內容的問題直接使用快取的回答
+        context_hash = hash_text(full_context)
+        if answer_cache is not None:
+            content = answer_cache.get(llm.model_name, template_version, question, context_hash)
+            if content is not None:
+                if on_token is not None:
+                    on_token(question, content)
+                return content
+
+        with span("llm", model=llm.model_name, question=question, stream=on_token is not None) as attributes:
+            if on_token is None:
+                llm_response = await llm.ainvoke(formatted_prompt)
+            else:
+                # 需要逐字輸出時改用 stream，最後仍回傳完整答案
+                llm_response = None
+                async for chunk in llm.astream(formatted_prompt):
+                    llm_response = chunk if llm_response is None else llm_response + chunk
+                    on_token(question, chunk.content)
+            content = llm_response.content if llm_response is not None else ""
+            record_llm_usage(attributes, llm.model_name, llm_response)
+
+        if answer_cache is not None:
+            answer_cache.put(llm.model_name, template_version, question, context_hash, content)
+        return content
+
+    async def answer_section(questions):
+        numbered = number_questions(questions)
+        # 每題各自的排名再輪流合併，章節內重複檢索到的段落只放一次；預算與保留的回答長度依題數放大
+        ranked = [interleave(upload_by_question[question], [result.page_content for result in rag_by_question[question]])
+                  for question in questions]
+        budget = packer.available(section_prompt_template, numbered, budget=packer.budget * len(questions),
+                                  reserved_output=packer.reserved_output * len(questions))
+        full_context = "\n".join(packer.pack(interleave(*ranked), budget))
+        formatted_prompt = section_prompt.format(context=full_context, questions=numbered)
+
+        context_hash = hash_text(full_context)
+        content = None
+        if answer_cache is not None:
+            content = answer_cache.get(section_llm.model_name, section_template_version, numbered, context_hash)
+        if content is None:
+            with span("llm", model=section_llm.model_name, questions=len(questions), stream=False) as attributes:
+                llm_response = await section_llm.ainvoke(formatted_prompt)
+                content = llm_response.content
+                record_llm_usage(attributes, section_llm.model_name, llm_response)
+
+        answers = parse_section_answers(content, len(questions))
+        # 只快取完整解析成功的回答
+        if answer_cache is not None and None not in answers:
+            answer_cache.put(section_llm.model_name, section_template_version, numbered, context_hash, content)
+        if on_token is not None:
+            for question, section_answer in zip(questions, answers):
+                if section_answer is not None:
+                    on_token(question, section_answer)
+        return answers
+
+    # 問題平行送出，但報告仍依照原本章節與問題的順序組合
+    expanded = expand_questions(questions_prompts, company_name)
+    questions = [question for _, question in expanded]
+    # 所有問題的檢索一次完成：一次 embedding、一次矩陣搜尋，再分配給各題
+    with span("retrieve", questions=len(questions)):
+        rag_by_question = dict(zip(questions, retriever.batch(questions)))
+        upload_by_question = dict(zip(questions, upload_index.search_many(questions)))
+    if (prompt_mode or get_prompt_mode()) == "section":
+        # 每個章節一次 LLM 呼叫，JSON 解析失敗的題目再逐題回答
+        section_llm = create_llm(json_output=True)
+        section_prompt = PromptTemplate(template=section_prompt_template, input_variables=["context", "questions"])
+        section_template_version = hash_text(section_prompt_template)[:12]
+        sections = [section_questions for _, section_questions in group_sections(expanded)]
+        answers = run_sections(sections, answer_section, answer, max_concurrency, timeout, on_result=on_answer)
+    else:
+        answers = run_questions(questions, answer, max_concurrency, timeout, on_result=on_answer)
+
+    for question, content in zip(questions, answers):
+        report.append(f"Question: {question}\nAnswer: {content}\n\n")
+
+    return "\n".join(report)
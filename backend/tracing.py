@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.answer_cache import get_answer_cache
+
+# 每個 /upload 請求一個 trace，抽取、OCR、檢索、每次 LLM 呼叫與 PDF 產生都記成 span
+# span 同時寫進 Prometheus histogram，報告完成後整份 trace 存成 PDF 旁邊的 .timing.json
+
+SPAN_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+SPAN_SECONDS = Histogram("credit_report_span_seconds", "Duration of traced pipeline spans", ["span"],
+                         buckets=SPAN_BUCKETS)
+SPAN_IN_FLIGHT = Gauge("credit_report_span_in_flight", "Pipeline spans currently running", ["span"])
+LLM_TOKENS = Counter("credit_report_llm_tokens_total", "LLM tokens used", ["model", "kind"])
+HTTP_SECONDS = Histogram("credit_report_http_request_seconds", "HTTP request latency",
+                         ["method", "endpoint", "status"], buckets=SPAN_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("credit_report_http_requests_in_flight", "HTTP requests currently being handled")
+JOBS_IN_FLIGHT = Gauge("credit_report_jobs_in_flight", "Report jobs currently running")
+
+_collectors_registered = False
+_collectors_lock = threading.Lock()
+
+_current_trace = contextvars.ContextVar("credit_report_trace", default=None)
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.id = trace_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, started, seconds, attributes):
+        with self._lock:
+            self.spans.append(dict(attributes, name=name, start=started - self._started, seconds=seconds))
+
+    def summary(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        totals = {}
+        llm = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        for span in spans:
+            total = totals.setdefault(span["name"], {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            total["count"] += 1
+            total["total_seconds"] += span["seconds"]
+            total["max_seconds"] = max(total["max_seconds"], span["seconds"])
+            if span["name"] == "llm":
+                llm["calls"] += 1
+                llm["prompt_tokens"] += span.get("prompt_tokens") or 0
+                llm["completion_tokens"] += span.get("completion_tokens") or 0
+        return {
+            "trace_id": self.id,
+            "started_at": self.started_at,
+            "total_seconds": time.perf_counter() - self._started,
+            "spans_by_name": totals,
+            "llm": llm,
+            "spans": spans,
+        }
+
+    def write_summary(self, pdf_path, **extra):
+        # report_xxx.pdf -> report_xxx.timing.json
+        path = f"{pdf_path.rsplit('.', 1)[0]}.timing.json"
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.summary(), **extra), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_trace_id():
+    trace = _current_trace.get()
+    return trace.id if trace is not None else None
+
+
+def record_span(name, started, seconds, **attributes):
+    # 給已經自行計時的程式碼使用 (started 為 time.perf_counter() 的值)
+    SPAN_SECONDS.labels(name).observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, started, seconds, attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    # with span("llm", model=...) as attrs: 區塊內可以再補 attrs["prompt_tokens"] 等資訊
+    SPAN_IN_FLIGHT.labels(name).inc()
+    started = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        SPAN_IN_FLIGHT.labels(name).dec()
+        record_span(name, started, time.perf_counter() - started, **attributes)
+
+
+def llm_usage(message):
+    # OpenAI 回傳 usage_metadata / token_usage，Ollama 回傳 prompt_eval_count / eval_count
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    metadata = getattr(message, "response_metadata", None) or {}
+    token_usage = metadata.get("token_usage")
+    if token_usage:
+        return token_usage.get("prompt_tokens"), token_usage.get("completion_tokens")
+    if "eval_count" in metadata:
+        return metadata.get("prompt_eval_count"), metadata.get("eval_count")
+    return None, None
+
+
+def record_llm_usage(attributes, model, message):
+    prompt_tokens, completion_tokens = llm_usage(message)
+    attributes["prompt_tokens"] = prompt_tokens
+    attributes["completion_tokens"] = completion_tokens
+    if prompt_tokens:
+        LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+
+
+@contextmanager
+def job_trace(trace):
+    # 在背景工作中把 trace 設成目前的 trace，asyncio 的 task 也會繼承
+    token = _current_trace.set(trace)
+    JOBS_IN_FLIGHT.inc()
+    try:
+        yield trace
+    finally:
+        JOBS_IN_FLIGHT.dec()
+        _current_trace.reset(token)
+
+
+class AnswerCacheCollector:
+    # 回答快取的命中次數由 AnswerCache 自己累計，/metrics 被讀取時才轉成 Prometheus 指標
+    def collect(self):
+        cache = get_answer_cache()
+        if cache is None:
+            return
+        stats = cache.stats()
+        lookups = CounterMetricFamily("credit_report_answer_cache_lookups", "Answer cache lookups by result",
+                                      labels=["result"])
+        lookups.add_metric(["hit"], stats["hits"])
+        lookups.add_metric(["semantic_hit"], stats["semantic_hits"])
+        lookups.add_metric(["miss"], stats["misses"])
+        yield lookups
+        yield GaugeMetricFamily("credit_report_answer_cache_entries", "Answers stored in the answer cache",
+                                value=stats["entries"])
+
+
+def instrument_app(app):
+    global _collectors_registered
+    with _collectors_lock:
+        if not _collectors_registered:
+            REGISTRY.register(AnswerCacheCollector())
+            _collectors_registered = True
+
+    # 每個請求都有 trace id (可由 X-Request-ID 帶入)，回應 header 帶 X-Trace-Id，並提供 /metrics
+    @app.before_request
+    def _start_request():
+        g.trace = Trace(request.headers.get("X-Request-ID"))
+        g.request_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _finish_request(response):
+        response.headers["X-Trace-Id"] = g.trace.id
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_SECONDS.labels(request.method, endpoint, response.status_code).observe(
+            time.perf_counter() - g.request_started)
+        return response
+
+    @app.teardown_request
+    def _teardown_request(exc):
+        if "request_started" in g:
+            HTTP_IN_FLIGHT.dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
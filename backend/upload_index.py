@@ -0,0 +1,32 @@
+import os
+import sys
+from langchain_community.vectorstores import FAISS
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.ann_index import search_batch
+from common.embedding_cache import batch_embed_queries
+
+
+def get_upload_top_k():
+    return max(1, int(os.getenv("UPLOAD_TOP_K", "4")))
+
+
+class UploadIndex:
+    # 每次 /upload 專用的暫時索引，只存在記憶體中，每個問題只取最相關的幾段上傳內容
+    def __init__(self, texts, embeddings, k=None):
+        self.texts = [text for text in texts if text and text.strip()]
+        self.k = k or get_upload_top_k()
+        self.embeddings = embeddings
+
+        if len(self.texts) > self.k:
+            self.docsearch = FAISS.from_texts(self.texts, embeddings)
+        else:
+            self.docsearch = None
+
+    def search_many(self, questions):
+        # 所有問題一次 embedding (與知識庫查詢共用快取中的查詢向量)、一次矩陣搜尋
+        if self.docsearch is None:
+            return [list(self.texts) for _ in questions]
+        vectors = batch_embed_queries(self.embeddings, questions)
+        return [[document.page_content for document in documents]
+                for documents in search_batch(self.docsearch, vectors, self.k)]
@@ -1,37 +1,46 @@
-import uuid
 import os
-import pytesseract
+import sys
+import threading
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from datetime import date
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_core.prompts import PromptTemplate
-from langchain_community.vectorstores import FAISS
-from PIL import Image
+from langchain_openai import OpenAIEmbeddings
+from warm_index import WarmIndex
+from report_runner import run_report
+from pdf_extract import extract_pdfs, extract_pdf_documents
+from ocr import ocr_images
+from report_renderer import render_report
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.embedding_cache import cached_embeddings
+from common.compact_index import save_compact_index, load_or_migrate
+from common.ann_index import build_vectorstore
+from common.fakes import fake_models_enabled, FakeEmbeddings
+from common.llm_provider import get_chat_model, warm_up_llm_in_background, get_openai_http_client
 class FAISSIndexer:
     def __init__(self):
         load_dotenv()
-        self.embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
+        if fake_models_enabled():
+            self.embeddings = cached_embeddings(FakeEmbeddings.from_env())
+        else:
+            self.embeddings = cached_embeddings(OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"),
+                                                                 http_client=get_openai_http_client()))
 
     def load_documents(self, documents_path="../documents/"):
-        documents = []
-        for filename in os.listdir(documents_path):
-            if filename.endswith(".pdf"):
-                loader = PyPDFLoader(os.path.join(documents_path, filename))
-                pages = loader.load_and_split()
-                documents.extend(page.page_content for page in pages)
+        filePaths = [os.path.join(documents_path, filename)
+                     for filename in sorted(os.listdir(documents_path)) if filename.endswith(".pdf")]
+        # 每個段落帶有來源檔案與頁碼的 metadata
+        documents, _ = extract_pdf_documents(filePaths)
+        return documents
 
     def build_faiss_index(self, documents, save_path="./faiss_index"):
-        docsearch = FAISS.from_texts(documents, self.embeddings)
-        docsearch.save_local(save_path)
+        # 索引類型由 FAISS_INDEX_TYPE 決定 (flat / ivf_flat / hnsw / ivf_sq / ivf_pq)
+        docsearch = build_vectorstore([document.page_content for document in documents], self.embeddings,
+                                      metadatas=[document.metadata for document in documents])
+        save_compact_index(docsearch, save_path)
 
     def load_faiss_index(self, save_path="../frontend/faiss_index"):
-        return FAISS.load_local(save_path, self.embeddings, allow_dangerous_deserialization=True)
+        return load_or_migrate(save_path, self.embeddings)
+
+REPORT_FONT = "./font/SimHei.ttf"
 
 promptTemplate = """
 # 背景設定
@@ -46,6 +55,21 @@ promptTemplate = """
 # 回答
 """
 
+# 章節模式：同一章節的問題共用一次檢索內容，一次回答
+sectionPromptTemplate = """
+# 背景設定
+請根據檢索出來的文件資料精確地回答使用者針對目標公司提出的每個問題。\n\n
+
+# 文件資料
+{context}
+
+# 問題
+{questions}
+
+# 回答格式
+只輸出一個 JSON 物件，key 為問題編號 ("1"、"2" ...)，value 為該題答案的字串，不要輸出其他文字。
+"""
+
 questions_prompts = {
     "1. 產業分析": [
         "1.1 告訴我{company_name}的國內生產與銷售價值概覽。",
@@ -94,108 +118,44 @@ questions_prompts = {
 
 
 def extract_text_from_image(filePath):
-    image = Image.open(filePath)
-    text = pytesseract.image_to_string(image)
-    return [text]
+    return ocr_images([filePath])
+
+def extract_texts_from_images(filePaths):
+    # 多張圖片一次送進 OCR process pool
+    return [text for text in ocr_images(filePaths) if text]
 
 def extract_texts_from_pdfs(filePaths):
-    all_texts = []
-    for filePath in filePaths:
-        loader = PyPDFLoader(filePath)
-        pages = loader.load_and_split()
-        all_texts.extend([page.page_content for page in pages])
+    all_texts, _ = extract_pdfs(filePaths)
     return all_texts
 
 
-def initialize_retriever():
-    indexer = FAISSIndexer()
-
-    if not os.path.exists("./faiss_index"):
-        documents = indexer.load_documents()
-        indexer.build_faiss_index(documents)
-    docsearch = indexer.load_faiss_index()
-
-    return docsearch.as_retriever(search_type='similarity', search_kwargs={'k': 3})
-
-def generate_report(context, company_name, retriever):
-    report = [] 
-    llm = ChatOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+_warm_index = None
+_warm_index_lock = threading.Lock()
 
-    for question_template in questions_prompts:
-        question = question_template.format(company_name=company_name)
-        results = retriever.get_relevant_documents(question)
-        context_from_rag = "\n".join([result.page_content for result in results])
+def get_warm_index():
+    # 整個 process 共用同一份 embedding model 與知識庫索引
+    global _warm_index
+    with _warm_index_lock:
+        if _warm_index is None:
+            _warm_index = WarmIndex(FAISSIndexer, build_path="./faiss_index", load_path="../frontend/faiss_index")
+    return _warm_index
 
-        if context_from_rag:
-            full_context = f"{context}\n{context_from_rag}"
-        else:
-            full_context = context
+def initialize_retriever():
+    return get_warm_index().as_retriever()
 
-        prompt = PromptTemplate(template=promptTemplate, input_variables=["context", "question"])
-        formatted_prompt = prompt.format(context=full_context, question=question)
-        llm_response = llm.invoke(formatted_prompt)
-        content = llm_response.content
+def create_llm(json_output=False):
+    # 整個 process 共用同一個 client (連線池、限流與重試)，LLM_PROVIDER 可改用 ollama / fake
+    return get_chat_model("openai", json_output)
 
-        report.append(f"Question: {question}\nAnswer: {content}\n\n")
+def warm_up_llm():
+    return warm_up_llm_in_background("openai")
 
-    return "\n".join(report)
+def generate_report(context, company_name, retriever, max_concurrency=None, timeout=None, embeddings=None, on_answer=None, on_token=None, prompt_mode=None):
+    # 報告流程在 report_runner.run_report，這裡只提供這個版本的 prompt、問題與 LLM
+    return run_report(context, company_name, retriever, embeddings or get_warm_index().embeddings, create_llm,
+                      promptTemplate, sectionPromptTemplate, questions_prompts, max_concurrency=max_concurrency,
+                      timeout=timeout, on_answer=on_answer, on_token=on_token, prompt_mode=prompt_mode)
 
 def save_to_pdf1(data, directory):
-    unique_filename = f"report_{uuid.uuid4().hex}.pdf"
-    file_path = os.path.join(directory, unique_filename)
-
-    doc = SimpleDocTemplate(file_path, pagesize=letter)
-    styles = getSampleStyleSheet()
-
-    title_style = styles['Title']
-    title_style.alignment = 1
-
-    heading_style = styles['Heading2']
-    heading_style.spaceAfter = 12
-
-    body_style = styles['BodyText']
-    body_style.spaceAfter = 12
-
-    pdfmetrics.registerFont(TTFont('SimHei', "./font/SimHei.ttf"))
-
-    c_heading_style = ParagraphStyle(
-        name='Chinese_h',
-        fontName='SimHei',
-        parent=styles['Heading2']
-    )
-
-    c_body_style = ParagraphStyle(
-        name='Chinese_b',
-        fontName='SimHei',
-        parent=styles['BodyText']
-    )
-
-    story = []
-
-    story.append(Paragraph("Credit Analysis Report", title_style))
-    story.append(Spacer(1, 24))
-    story.append(Paragraph(f"Company Name: {data['company_name']}", c_body_style))
-    story.append(Spacer(1, 12))
-    story.append(Paragraph(f"Report Date: {date.today().strftime('%Y-%m-%d')}", body_style))
-    story.append(PageBreak())
-
-    lines = data['report'].split("\n")
-    for line in lines:
-        if line.startswith("Question:"):
-            story.append(Paragraph(line, c_heading_style))
-        elif line.startswith("Answer:"):
-            story.append(Paragraph(line, c_body_style))
-        else:
-            story.append(Paragraph(line, c_body_style))
-        story.append(Spacer(1, 12))
-
-    def add_page_footer(canvas, doc):
-        canvas.saveState()
-        footer = Paragraph("Credit Analysis Report - %d " % doc.page, styles['Normal'])
-        w, h = footer.wrap(doc.width, doc.bottomMargin)
-        footer.drawOn(canvas, doc.leftMargin, h)
-        canvas.restoreState()
-
-    doc.build(story, onLaterPages=add_page_footer)
-
-    return file_path
+    # 字型與樣式在 renderer 的 worker process 中只載入一次；REPORT_FORMAT=html / markdown 時輸出對應格式
+    return render_report(data, directory, font_path=REPORT_FONT)
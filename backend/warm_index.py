@@ -0,0 +1,164 @@
+import os
+import sys
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from langchain_core.retrievers import BaseRetriever
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.lexical_index import get_retrieval_mode, hybrid_search, load_lexical_index
+
+
+def get_memo_size():
+    return int(os.getenv("RETRIEVAL_MEMO_SIZE", "1024"))
+
+
+class WarmIndexRetriever(BaseRetriever):
+    # 單一查詢與 batch 都交給 WarmIndex.search_many，batch 時所有查詢只做一次 embedding 與一次矩陣搜尋
+    warm_index: Any
+    k: int = 3
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.warm_index.search_many([query], self.k)[0]
+
+    def batch(self, inputs, config=None, **kwargs):
+        return self.warm_index.search_many(list(inputs), self.k)
+
+    async def abatch(self, inputs, config=None, **kwargs):
+        return await asyncio.to_thread(self.batch, inputs)
+
+
+class WarmIndex:
+    def __init__(self, indexer_factory, build_path, load_path, k=3):
+        self.indexer_factory = indexer_factory
+        self.build_path = build_path
+        self.load_path = load_path
+        self.k = k
+
+        self.indexer = None
+        self.docsearch = None
+        self.lexical = None
+        self.loaded_at = None
+        self.error = None
+        self._signature = None
+        self._lock = threading.Lock()
+        # 知識庫查詢結果的 LRU，key 含索引的載入時間，索引重新載入後舊結果自然失效
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    def _index_signature(self):
+        signature = []
+        # meta.json 在索引寫入完成後才會更新
+        for filename in ("index.faiss", "meta.json"):
+            path = os.path.join(self.load_path, filename)
+            if not os.path.exists(path):
+                return None
+            stat = os.stat(path)
+            signature.append((stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def _load(self):
+        # embedding model 只建立一次，重新載入時只換掉 FAISS 索引
+        if self.indexer is None:
+            self.indexer = self.indexer_factory()
+
+        if not os.path.exists(self.build_path):
+            documents = self.indexer.load_documents()
+            self.indexer.build_faiss_index(documents, save_path=self.build_path)
+
+        self.docsearch = self.indexer.load_faiss_index(save_path=self.load_path)
+        # BM25 索引只在 lexical / hybrid 模式時載入
+        self.lexical = load_lexical_index(self.load_path, self.docsearch) if get_retrieval_mode() != "vector" else None
+        self._signature = self._index_signature()
+        self.loaded_at = time.time()
+        self.error = None
+        print(f"FAISS index loaded from {self.load_path}")
+
+    def warm_up(self):
+        with self._lock:
+            try:
+                if self.docsearch is None:
+                    self._load()
+            except Exception as e:
+                self.error = str(e)
+                raise
+
+    def warm_up_in_background(self):
+        def run():
+            try:
+                self.warm_up()
+            except Exception as e:
+                print(f"FAISS index warm up failed: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def embeddings(self):
+        with self._lock:
+            if self.indexer is None:
+                self.indexer = self.indexer_factory()
+            return self.indexer.embeddings
+
+    def get_docsearch(self):
+        with self._lock:
+            if self.docsearch is None:
+                self._load()
+            else:
+                signature = self._index_signature()
+                if signature is not None and signature != self._signature:
+                    # 索引還在寫入時可能讀取失敗，先沿用舊的索引
+                    try:
+                        self._load()
+                    except Exception as e:
+                        self.error = str(e)
+                        print(f"FAISS index reload failed: {e}")
+            return self.docsearch
+
+    def as_retriever(self):
+        self.get_docsearch()
+        return WarmIndexRetriever(warm_index=self, k=self.k)
+
+    def search_many(self, queries, k=None):
+        # 沒查過的問題一次 embedding、一次以矩陣搜尋 (hybrid 模式下 BM25 完全命中的問題不需要 embedding)，
+        # 結果依 queries 的順序回傳
+        k = k or self.k
+        mode = get_retrieval_mode()
+        docsearch = self.get_docsearch()
+        lexical = self.lexical
+        loaded_at = self.loaded_at
+
+        results = {}
+        with self._memo_lock:
+            for query in queries:
+                key = (loaded_at, mode, k, query)
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+                    results[query] = self._memo[key]
+        missing = [query for query in dict.fromkeys(queries) if query not in results]
+
+        if missing:
+            found = hybrid_search(docsearch, lexical, self.embeddings, missing, k, mode)
+            with self._memo_lock:
+                for query, documents in zip(missing, found):
+                    results[query] = documents
+                    self._memo[(loaded_at, mode, k, query)] = documents
+                while len(self._memo) > get_memo_size():
+                    self._memo.popitem(last=False)
+
+        return [list(results[query]) for query in queries]
+
+    def is_ready(self):
+        return self.docsearch is not None
+
+    def status(self):
+        return {
+            "ready": self.is_ready(),
+            "index_path": self.load_path,
+            "loaded_at": self.loaded_at,
+            "documents": self.docsearch.index.ntotal if self.docsearch is not None else 0,
+            "error": self.error,
+        }
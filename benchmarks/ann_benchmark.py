@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+import faiss
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "backend"))
+
+from common.ann_index import INDEX_TYPES, build_index
+from common.embedding_cache import cached_embeddings
+from pdf_extract import extract_pdfs
+
+# 以 documents/ 語料比較不同 FAISS 索引的 recall@k、查詢延遲與索引大小
+# python -m benchmarks.ann_benchmark --embeddings fastembed --k 3 --output ann.json
+
+
+def load_embeddings(name):
+    if name == "openai":
+        from dotenv import load_dotenv
+        from langchain_openai import OpenAIEmbeddings
+        load_dotenv()
+        return cached_embeddings(OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY")))
+    from langchain_community.embeddings import FastEmbedEmbeddings
+    return cached_embeddings(FastEmbedEmbeddings())
+
+
+def sample_queries(texts, count, seed):
+    # 從語料隨機取段落的開頭當作查詢，模擬使用者只記得部分內容的提問
+    rng = random.Random(seed)
+    picked = rng.sample(texts, min(count, len(texts)))
+    return [text[:60] for text in picked]
+
+
+def recall_at_k(results, ground_truth, k):
+    hits = 0
+    for found, expected in zip(results, ground_truth):
+        hits += len(set(found[:k]) & set(expected[:k]))
+    return hits / (len(ground_truth) * k)
+
+
+def measure(index, queries, k):
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(ids[0].tolist())
+    return results, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", default=os.path.join(ROOT, "documents"))
+    parser.add_argument("--embeddings", choices=["fastembed", "openai"], default="fastembed")
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    file_paths = [os.path.join(args.documents, filename)
+                  for filename in sorted(os.listdir(args.documents)) if filename.endswith(".pdf")]
+    texts, _ = extract_pdfs(file_paths)
+    embeddings = load_embeddings(args.embeddings)
+
+    vectors = np.array(embeddings.embed_documents(texts), dtype="float32")
+    queries = np.array([embeddings.embed_query(query) for query in sample_queries(texts, args.queries, args.seed)],
+                       dtype="float32")
+    print(f"{len(texts)} chunks, dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    flat = build_index(vectors, "flat")
+    ground_truth, _ = measure(flat, queries, args.k)
+
+    rows = []
+    for index_type in args.types:
+        started = time.perf_counter()
+        index = build_index(vectors, index_type)
+        build_seconds = time.perf_counter() - started
+
+        results, latencies = measure(index, queries, args.k)
+        latencies.sort()
+        rows.append({
+            "index_type": index_type,
+            "build_seconds": build_seconds,
+            "recall_at_k": recall_at_k(results, ground_truth, args.k),
+            "latency_ms_mean": sum(latencies) / len(latencies),
+            "latency_ms_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "index_bytes": int(faiss.serialize_index(index).size),
+        })
+
+    print(f"{'type':<10}{'recall@k':>10}{'mean ms':>10}{'p95 ms':>10}{'size MB':>10}{'build s':>10}")
+    for row in rows:
+        print(f"{row['index_type']:<10}{row['recall_at_k']:>10.3f}{row['latency_ms_mean']:>10.3f}"
+              f"{row['latency_ms_p95']:>10.3f}{row['index_bytes'] / 1024 / 1024:>10.2f}{row['build_seconds']:>10.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"chunks": len(texts), "k": args.k, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import numpy as np
+import faiss
+from pypdf import PdfReader
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "backend"))
+
+from common.ann_index import build_index
+from common.chunker import TOKENIZER_MODEL, RecursiveChunker, SentenceChunker
+from common.context_packer import ContextPacker, get_token_counter
+from common.embedding_cache import cached_embeddings
+from common.fakes import FakeEmbeddings
+from report_runner import expand_questions
+from benchmarks.ann_benchmark import load_embeddings
+
+# 比較不同切段設定的段落數、索引大小、檢索延遲與每題送進 prompt 的 token 數
+# python -m benchmarks.chunk_benchmark --embeddings fastembed --settings recursive sentence:200:20 sentence:400:50
+
+
+def parse_setting(setting):
+    # recursive 或 sentence:<CHUNK_TOKENS>:<CHUNK_OVERLAP_TOKENS>
+    if setting == "recursive":
+        return RecursiveChunker()
+    name, chunk_tokens, overlap_tokens = setting.split(":")
+    if name != "sentence":
+        raise ValueError(f"Unknown chunker setting: {setting}")
+    return SentenceChunker(int(chunk_tokens), int(overlap_tokens))
+
+
+def read_pages(documents_path):
+    # 只讀文字層，所有設定共用同一份頁面文字
+    pages = []
+    for filename in sorted(os.listdir(documents_path)):
+        if filename.endswith(".pdf"):
+            for page_number, page in enumerate(PdfReader(os.path.join(documents_path, filename)).pages):
+                pages.append((page.extract_text() or "", {"source": filename, "page": page_number}))
+    return pages
+
+
+def run_setting(chunker, pages, embeddings, questions, k, packer):
+    count = get_token_counter(TOKENIZER_MODEL)
+    started = time.perf_counter()
+    chunks = [text for page_text, metadata in pages for text, _ in chunker.split_page(page_text, metadata)]
+    chunk_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vectors = np.array(embeddings.embed_documents(chunks), dtype="float32")
+    index = build_index(vectors, "flat")
+    build_seconds = time.perf_counter() - started
+
+    latencies = []
+    retrieved_tokens = []
+    packed_tokens = []
+    for question in questions:
+        started = time.perf_counter()
+        query = np.array([embeddings.embed_query(question)], dtype="float32")
+        _, ids = index.search(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found = [chunks[i] for i in ids[0] if i != -1]
+        retrieved_tokens.append(sum(count(text) for text in found))
+        packed_tokens.append(sum(count(text) for text in packer.pack(found)))
+
+    chunk_tokens = [count(text) for text in chunks]
+    return {
+        "chunks": len(chunks),
+        "mean_chunk_tokens": sum(chunk_tokens) / len(chunk_tokens) if chunk_tokens else 0,
+        "max_chunk_tokens": max(chunk_tokens, default=0),
+        "index_bytes": faiss.serialize_index(index).nbytes,
+        "text_bytes": sum(len(text.encode("utf-8")) for text in chunks),
+        "chunk_seconds": chunk_seconds,
+        "embed_and_build_seconds": build_seconds,
+        "retrieval_ms_mean": sum(latencies) / len(latencies),
+        "retrieval_ms_p95": sorted(latencies)[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "prompt_tokens_per_question": sum(retrieved_tokens) / len(retrieved_tokens),
+        "packed_tokens_per_question": sum(packed_tokens) / len(packed_tokens),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", default=os.path.join(ROOT, "documents"))
+    parser.add_argument("--embeddings", choices=["fake", "fastembed", "openai"], default="fastembed")
+    parser.add_argument("--variant", choices=["llama", "openai"], default="llama", help="使用哪個版本的報告問題")
+    parser.add_argument("--company", default="測試公司")
+    parser.add_argument("--settings", nargs="+",
+                        default=["recursive", "sentence:200:20", "sentence:400:50", "sentence:800:100"])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    # 每個設定的段落不同，快取命中會讓 embedding 時間失真
+    os.environ["EMBEDDING_CACHE"] = "false"
+    if args.embeddings == "fake":
+        embeddings = cached_embeddings(FakeEmbeddings.from_env())
+    else:
+        embeddings = load_embeddings(args.embeddings)
+
+    utils = importlib.import_module(f"utils_{args.variant}")
+    questions = [question for _, question in expand_questions(utils.questions_prompts, args.company)]
+    pages = read_pages(args.documents)
+    packer = ContextPacker(TOKENIZER_MODEL)
+    print(f"{len(pages)} pages, {len(questions)} questions, k={args.k}")
+
+    rows = {}
+    for setting in args.settings:
+        rows[setting] = run_setting(parse_setting(setting), pages, embeddings, questions, args.k, packer)
+
+    print(f"{'setting':<20}{'chunks':>8}{'avg tok':>9}{'index KB':>10}{'query ms':>10}{'p95 ms':>9}"
+          f"{'prompt tok':>12}{'packed tok':>12}")
+    for setting, row in rows.items():
+        print(f"{setting:<20}{row['chunks']:>8}{row['mean_chunk_tokens']:>9.0f}{row['index_bytes'] / 1024:>10.1f}"
+              f"{row['retrieval_ms_mean']:>10.2f}{row['retrieval_ms_p95']:>9.2f}"
+              f"{row['prompt_tokens_per_question']:>12.0f}{row['packed_tokens_per_question']:>12.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"documents": args.documents, "embeddings": args.embeddings, "k": args.k, "results": rows},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
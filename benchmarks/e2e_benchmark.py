@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import importlib
+import threading
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+BACKEND = os.path.join(ROOT, "backend")
+
+# 離線端對端 benchmark：以 FakeChatModel / FakeEmbeddings 取代 OpenAI 與 Ollama，在 documents/ 的 PDF 上量測
+# 抽取、embedding、檢索、LLM、save_to_pdf1 各階段、/upload 端對端延遲與多使用者同時上傳的吞吐量
+# python -m benchmarks.e2e_benchmark --llm-latency 1.5 --users 1 4 8
+
+
+def configure_env(args):
+    os.environ["FAKE_MODELS"] = "true"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+    os.environ["FAKE_LLM_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["FAKE_EMBEDDING_LATENCY"] = str(args.embedding_latency)
+    os.environ["FAKE_EMBEDDING_LATENCY_PER_TEXT"] = str(args.embedding_latency_per_text)
+    os.environ["REPORT_MAX_CONCURRENCY"] = str(args.max_concurrency)
+    os.environ["REPORT_PROMPT_MODE"] = args.prompt_mode
+    os.environ["REPORT_WORKERS"] = str(max(args.users))
+    if not args.with_caches:
+        # 快取命中會讓重複執行的數字失真，預設關閉
+        os.environ["ANSWER_CACHE"] = "false"
+        os.environ["EMBEDDING_CACHE"] = "false"
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def run_upload(client, upload_path, company_name):
+    started = time.perf_counter()
+    with open(upload_path, "rb") as f:
+        response = client.post(
+            "/upload",
+            data={"company_name": company_name, "files": [(f, os.path.basename(upload_path))]},
+            content_type="multipart/form-data",
+        )
+    job_id = response.get_json()["job_id"]
+    while True:
+        job = client.get(f"/jobs/{job_id}").get_json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    job["latency_seconds"] = time.perf_counter() - started
+    return job
+
+
+def run_concurrent(app, users, upload_path, company_name):
+    jobs = [None] * users
+
+    def worker(i):
+        jobs[i] = run_upload(app.test_client(), upload_path, company_name)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = [job["latency_seconds"] for job in jobs]
+    return {
+        "users": users,
+        "seconds": elapsed,
+        "failed": sum(1 for job in jobs if job["status"] != "done"),
+        "reports_per_minute": users * 60 / elapsed,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--variant", choices=["llama", "openai"], default="llama",
+                        help="openai 版本的 save_to_pdf1 需要 backend/font/SimHei.ttf")
+    parser.add_argument("--documents", default=os.path.join(ROOT, "documents"))
+    parser.add_argument("--upload", default=os.path.join(ROOT, "documents", "信審報告樣本_1.pdf"))
+    parser.add_argument("--company", default="測試公司")
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--embedding-latency-per-text", type=float, default=0.001)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--prompt-mode", choices=["question", "section"], default="question")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--with-caches", action="store_true")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    configure_env(args)
+    # 後端模組使用相對路徑 (../upload、./font ...)，需要在 backend/ 下執行
+    os.chdir(BACKEND)
+    sys.path.insert(0, BACKEND)
+    sys.path.append(ROOT)
+
+    from pdf_extract import extract_pdfs, extract_pdf_documents
+    from warm_index import WarmIndex
+    from report_runner import expand_questions
+    utils = importlib.import_module(f"utils_{args.variant}")
+
+    workdir = tempfile.mkdtemp(prefix="credit-report-bench-")
+    index_dir = os.path.join(workdir, "faiss_index")
+    stages = {}
+
+    file_paths = [os.path.join(args.documents, filename)
+                  for filename in sorted(os.listdir(args.documents)) if filename.endswith(".pdf")]
+    (documents, extract_stats), stages["extract_documents"] = timed(extract_pdf_documents, file_paths)
+
+    indexer = utils.FAISSIndexer()
+    _, stages["embed_and_build_index"] = timed(indexer.build_faiss_index, documents, save_path=index_dir)
+
+    # 讓 initialize_retriever / app 使用 benchmark 的暫存索引
+    utils._warm_index = WarmIndex(utils.FAISSIndexer, build_path=index_dir, load_path=index_dir)
+    retriever, stages["load_index"] = timed(utils.initialize_retriever)
+
+    questions = [question for _, question in expand_questions(utils.questions_prompts, args.company)]
+    _, stages["retrieval_one_by_one"] = timed(lambda: [retriever.invoke(question) for question in questions])
+    # 第一次 batch 會 embedding + 矩陣搜尋，第二次命中查詢結果的 memo
+    _, stages["retrieval_batch"] = timed(retriever.batch, [f"{question} " for question in questions])
+    _, stages["retrieval_batch_memoized"] = timed(retriever.batch, [f"{question} " for question in questions])
+    # BM25 (RETRIEVAL_MODE=lexical / hybrid) 不需要 embedding
+    from common.lexical_index import LexicalIndex
+    lexical, stages["build_lexical_index"] = timed(LexicalIndex.from_docsearch, utils._warm_index.get_docsearch())
+    _, stages["retrieval_lexical"] = timed(lambda: [lexical.search(question, 3) for question in questions])
+
+    (upload_texts, _), stages["extract_upload"] = timed(extract_pdfs, [args.upload])
+    report, stages["generate_report"] = timed(utils.generate_report, upload_texts, args.company, retriever)
+    _, stages["save_to_pdf1"] = timed(utils.save_to_pdf1, {"report": report, "company_name": args.company}, workdir)
+
+    app_module = importlib.import_module(f"app_{args.variant}")
+    # 上傳檔案與報告也放在暫存目錄，不寫進 repo 的 upload/ report/ 或使用者的桌面
+    from artifact_store import ArtifactStore
+    app_module.upload_store = ArtifactStore(os.path.join(workdir, "upload"))
+    app_module.report_store = ArtifactStore(os.path.join(workdir, "report"))
+    upload_job = run_upload(app_module.app.test_client(), args.upload, args.company)
+    upload = {
+        "latency_seconds": upload_job["latency_seconds"],
+        "status": upload_job["status"],
+        "stages": {
+            name: stage["finished_at"] - stage["started_at"]
+            for name, stage in upload_job["stages"].items()
+            if stage["started_at"] and stage["finished_at"]
+        },
+    }
+
+    concurrency = [run_concurrent(app_module.app, users, args.upload, args.company) for users in args.users]
+
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "corpus": {"files": len(file_paths), "pages": extract_stats["pages"], "chunks": len(documents)},
+        "questions": len(questions),
+        "stages": stages,
+        "upload": upload,
+        "concurrency": concurrency,
+    }
+
+    for name, seconds in stages.items():
+        print(f"{name:<28}{seconds:>10.3f}s")
+    print(f"{'/upload end-to-end':<28}{upload['latency_seconds']:>10.3f}s")
+    for row in concurrency:
+        print(f"{row['users']:>3} users: {row['reports_per_minute']:.2f} reports/min, "
+              f"p50 {row['latency_p50']:.2f}s, p95 {row['latency_p95']:.2f}s, {row['failed']} failed")
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results",
+                                         f"e2e-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import date
+from pypdf import PdfReader
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "backend"))
+
+import report_renderer
+from report_renderer import render_report
+
+# 比較舊版 save_to_pdf1 (每次註冊字型、每行一個 Paragraph + Spacer) 與新的 renderer 產生大份報告的時間
+# python -m benchmarks.render_benchmark --pages 100 --repeat 3
+
+
+def make_report(entries, answer_chars):
+    sentence = "公司營收較去年同期成長，主要來自海外訂單增加與產品組合改善。Revenue grew on export orders. "
+    answer = (sentence * (answer_chars // len(sentence) + 1))[:answer_chars]
+    report = []
+    for i in range(entries):
+        report.append(f"Question: {i + 1}. 請提供測試公司的第 {i + 1} 項財務資訊。\nAnswer: {answer}\n第二段補充說明。\n\n")
+    return "\n".join(report)
+
+
+def legacy_save_to_pdf(data, directory, font_path):
+    # 舊版 save_to_pdf1 的寫法，只用來比較
+    file_path = os.path.join(directory, "legacy.pdf")
+    doc = SimpleDocTemplate(file_path, pagesize=letter)
+    styles = getSampleStyleSheet()
+    body_font = styles['BodyText'].fontName
+    if font_path:
+        pdfmetrics.registerFont(TTFont('SimHei', font_path))
+        body_font = 'SimHei'
+    heading_style = ParagraphStyle(name='Chinese_h', fontName=body_font, parent=styles['Heading2'])
+    body_style = ParagraphStyle(name='Chinese_b', fontName=body_font, parent=styles['BodyText'])
+
+    story = [Paragraph("Credit Analysis Report", styles['Title']), Spacer(1, 24),
+             Paragraph(f"Company Name: {data['company_name']}", body_style), Spacer(1, 12),
+             Paragraph(f"Report Date: {date.today().strftime('%Y-%m-%d')}", styles['BodyText']), PageBreak()]
+    for line in data['report'].split("\n"):
+        story.append(Paragraph(line, heading_style if line.startswith("Question:") else body_style))
+        story.append(Spacer(1, 12))
+
+    def add_page_footer(canvas, doc):
+        canvas.saveState()
+        footer = Paragraph("Credit Analysis Report - %d " % doc.page, styles['Normal'])
+        w, h = footer.wrap(doc.width, doc.bottomMargin)
+        footer.drawOn(canvas, doc.leftMargin, h)
+        canvas.restoreState()
+
+    doc.build(story, onLaterPages=add_page_footer)
+    return file_path
+
+
+def measure(fn, repeat):
+    timings = []
+    path = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        path = fn()
+        timings.append(time.perf_counter() - started)
+    return {"mean_seconds": sum(timings) / len(timings), "min_seconds": min(timings), "path": path}
+
+
+def main():
+    default_font = os.path.join(ROOT, "backend", "font", "SimHei.ttf")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=100, help="目標頁數 (依每頁約 3 題估算題數)")
+    parser.add_argument("--answer-chars", type=int, default=400)
+    parser.add_argument("--font", default=default_font if os.path.exists(default_font) else None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    data = {"report": make_report(args.pages * 3, args.answer_chars), "company_name": "測試公司"}
+    directory = tempfile.mkdtemp(prefix="render-bench-")
+
+    rows = {}
+    rows["legacy_pdf"] = measure(lambda: legacy_save_to_pdf(data, directory, args.font), args.repeat)
+
+    os.environ["RENDER_WORKERS"] = "0"
+    rows["pdf_in_process"] = measure(lambda: render_report(data, directory, "pdf", args.font), args.repeat)
+
+    os.environ["RENDER_WORKERS"] = "1"
+    report_renderer.warm_up(args.font)
+    rows["pdf_worker"] = measure(lambda: render_report(data, directory, "pdf", args.font), args.repeat)
+    rows["html"] = measure(lambda: render_report(data, directory, "html"), args.repeat)
+    rows["markdown"] = measure(lambda: render_report(data, directory, "markdown"), args.repeat)
+
+    print(f"{'renderer':<16}{'mean s':>10}{'min s':>10}{'pages':>8}{'size KB':>10}")
+    for name, row in rows.items():
+        path = row.pop("path")
+        row["pages"] = len(PdfReader(path).pages) if path.endswith(".pdf") else None
+        row["bytes"] = os.path.getsize(path)
+        pages = row["pages"] if row["pages"] is not None else "-"
+        print(f"{name:<16}{row['mean_seconds']:>10.3f}{row['min_seconds']:>10.3f}{pages:>8}{row['bytes'] / 1024:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"entries": args.pages * 3, "font": args.font, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import os
+import math
+import uuid
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_sq", "ivf_pq")
+
+
+def get_index_type():
+    return os.getenv("FAISS_INDEX_TYPE", "flat")
+
+
+def _default_nlist(n):
+    # 一般建議 nlist 約 4√n，且每個 cluster 至少要有 39 筆訓練資料
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def _pq_subquantizers(dim, m):
+    # PQ 的子向量數必須整除維度，找不超過 m 的最大因數
+    for candidate in range(min(m, dim), 0, -1):
+        if dim % candidate == 0:
+            return candidate
+    return 1
+
+
+def create_index(index_type, dim, n, nlist=None, nprobe=None, hnsw_m=32, ef_search=64, pq_m=16, pq_bits=8):
+    nlist = nlist or _default_nlist(n)
+    nprobe = nprobe or max(1, nlist // 8)
+
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efSearch = ef_search
+        return index
+
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    elif index_type == "ivf_sq":
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit)
+    elif index_type == "ivf_pq":
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_subquantizers(dim, pq_m), pq_bits)
+    else:
+        raise ValueError(f"Unknown FAISS index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+    index.nprobe = nprobe
+    return index
+
+
+def build_index(vectors, index_type=None, **params):
+    index_type = index_type or get_index_type()
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, dim = vectors.shape
+
+    # 資料量不足以訓練 IVF / PQ 時退回 flat
+    min_points = {"ivf_flat": 39, "ivf_sq": 39, "ivf_pq": 2 ** params.get("pq_bits", 8)}.get(index_type, 0)
+    if n < min_points:
+        print(f"Only {n} vectors, too few to train {index_type}; using flat index")
+        index_type = "flat"
+
+    index = create_index(index_type, dim, n, **params)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def build_vectorstore(texts, embeddings, index_type=None, metadatas=None, **params):
+    # 與 FAISS.from_texts 相同的結果，但可以選擇索引類型
+    vectors = embeddings.embed_documents(texts)
+    index = build_index(np.array(vectors, dtype="float32"), index_type, **params)
+
+    metadatas = metadatas or [{} for _ in texts]
+    ids = [str(uuid.uuid4()) for _ in texts]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=text, metadata=metadata)
+        for doc_id, text, metadata in zip(ids, texts, metadatas)
+    })
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
+
+
+def search_batch(docsearch, vectors, k):
+    # 多個查詢向量以一次矩陣查詢搜尋 FAISS 向量庫，回傳每個查詢的 Document 列表
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if getattr(docsearch, "_normalize_L2", False):
+        faiss.normalize_L2(vectors)
+    _, ids = docsearch.index.search(vectors, k)
+    return [
+        [docsearch.docstore.search(docsearch.index_to_docstore_id[i]) for i in row if i != -1]
+        for row in ids
+    ]
@@ -0,0 +1,151 @@
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from dotenv import load_dotenv
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class AnswerCache:
+    # 以 SQLite 保存 LLM 的回答，key 為 (模型, prompt 版本, 問題, 檢索內容雜湊)
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=10000, similarity=0.95):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    template_version TEXT,
+                    context_hash TEXT,
+                    answer TEXT,
+                    embedding BLOB,
+                    created_at REAL,
+                    accessed_at REAL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS answers_context ON answers (model, template_version, context_hash)"
+            )
+
+    @staticmethod
+    def make_key(model, template_version, question, context_hash):
+        return hash_text("\0".join([model, template_version, question, context_hash]))
+
+    def _expired(self, created_at, now):
+        return self.ttl and created_at < now - self.ttl
+
+    def get(self, model, template_version, question, context_hash):
+        key = self.make_key(model, template_version, question, context_hash)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT answer, created_at FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1], now):
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def get_similar(self, model, template_version, context_hash, embedding):
+        # 語意層：同樣的檢索內容下，問題向量夠接近就沿用之前的回答
+        if not self.similarity or embedding is None:
+            return None
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, answer, embedding, created_at FROM answers "
+                "WHERE model = ? AND template_version = ? AND context_hash = ? AND embedding IS NOT NULL",
+                (model, template_version, context_hash),
+            ).fetchall()
+            best_key, best_answer, best_score = None, None, self.similarity
+            for key, answer, blob, created_at in rows:
+                if self._expired(created_at, now):
+                    continue
+                score = _cosine(embedding, array("f", blob))
+                if score >= best_score:
+                    best_key, best_answer, best_score = key, answer, score
+            if best_key is None:
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, best_key))
+            # get() 已經記成 miss，語意命中時改記到 semantic_hits
+            self.misses -= 1
+            self.semantic_hits += 1
+            return best_answer
+
+    def put(self, model, template_version, question, context_hash, answer, embedding=None):
+        key = self.make_key(model, template_version, question, context_hash)
+        blob = array("f", embedding).tobytes() if embedding is not None else None
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, template_version, context_hash, answer, blob, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    # ANSWER_CACHE=false 時回傳 None，呼叫端直接略過快取
+    global _cache
+    load_dotenv()
+    if os.getenv("ANSWER_CACHE", "true").lower() != "true":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache(
+                os.getenv("ANSWER_CACHE_PATH", "../cache/answers.sqlite"),
+                ttl=float(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600))),
+                max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000")),
+                similarity=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")),
+            )
+        return _cache
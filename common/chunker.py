@@ -0,0 +1,140 @@
+import os
+import re
+from abc import ABC, abstractmethod
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from common.context_packer import get_token_counter
+
+# 建立索引時把每頁文字切成段落，CHUNKER 選擇切法：
+#   recursive (預設)：與 load_and_split() 相同的 RecursiveCharacterTextSplitter (約 4000 字元、重疊 200 字元)
+#   sentence：以 token 計算大小 (CHUNK_TOKENS) 與重疊 (CHUNK_OVERLAP_TOKENS)，只在句子 (。！？；) 或空行處切開，
+#             行首的「第X條」一定另起一段，法規條文不會和前一條混在同一段
+# 每段的 metadata 帶有來源檔案 (source)、頁碼 (page，0 起算，與 PyPDFLoader 相同)、頁內序號 (chunk) 與所屬條文 (article)
+
+CHUNKERS = ("recursive", "sentence")
+# llama3 的 tokenizer 與 cl100k 相近，兩個版本都以 cl100k 計算
+TOKENIZER_MODEL = "gpt-3.5-turbo"
+
+_ARTICLE_HEADER = re.compile(r"^[ \t　]*(第[ \t]*[0-9一二三四五六七八九十百千零〇]+[ \t]*條(?:之[0-9一二三四五六七八九十]+)?)",
+                             re.MULTILINE)
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?])|(?<=\n)[ \t]*\n")
+_SPACES = re.compile(r"\s+")
+
+
+def get_chunker_name():
+    name = os.getenv("CHUNKER", "recursive")
+    if name not in CHUNKERS:
+        raise ValueError(f"Unknown CHUNKER: {name} (expected one of {', '.join(CHUNKERS)})")
+    return name
+
+
+def get_chunk_tokens():
+    return int(os.getenv("CHUNK_TOKENS", "400"))
+
+
+def get_chunk_overlap_tokens():
+    return int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+
+
+class Chunker(ABC):
+    name = None
+
+    def signature(self):
+        # 記在索引的 manifest 中，設定改變時知道要重建
+        return self.name
+
+    @abstractmethod
+    def split_text(self, text):
+        # 回傳 [(段落, 額外的 metadata)]
+        ...
+
+    def split_page(self, text, metadata):
+        return [(chunk, dict(metadata, chunk=i, **extra)) for i, (chunk, extra) in enumerate(self.split_text(text))]
+
+
+class RecursiveChunker(Chunker):
+    name = "recursive"
+
+    def __init__(self):
+        self._splitter = RecursiveCharacterTextSplitter()
+
+    def split_text(self, text):
+        return [(chunk, {}) for chunk in self._splitter.split_text(text)]
+
+
+class SentenceChunker(Chunker):
+    name = "sentence"
+
+    def __init__(self, chunk_tokens=None, overlap_tokens=None):
+        self.chunk_tokens = chunk_tokens or get_chunk_tokens()
+        self.overlap_tokens = overlap_tokens if overlap_tokens is not None else get_chunk_overlap_tokens()
+        if self.overlap_tokens >= self.chunk_tokens:
+            raise ValueError("CHUNK_OVERLAP_TOKENS must be smaller than CHUNK_TOKENS")
+        self.count = get_token_counter(TOKENIZER_MODEL)
+
+    def signature(self):
+        return f"{self.name}:{self.chunk_tokens}:{self.overlap_tokens}"
+
+    def _articles(self, text):
+        # [(條文名稱或 None, 文字)]，第一個條文之前的文字屬於 None
+        matches = list(_ARTICLE_HEADER.finditer(text))
+        if not matches:
+            return [(None, text)]
+        blocks = [(None, text[:matches[0].start()])]
+        for i, match in enumerate(matches):
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+            blocks.append((_SPACES.sub("", match.group(1)), text[match.start():end]))
+        return blocks
+
+    def _sentences(self, text):
+        # 句子保留原本的標點與換行，超過段落大小的句子依長度比例硬切
+        sentences = []
+        for sentence in _SENTENCE_END.split(text):
+            if not sentence.strip():
+                continue
+            tokens = self.count(sentence)
+            if tokens <= self.chunk_tokens:
+                sentences.append((sentence, tokens))
+                continue
+            size = max(1, len(sentence) * self.chunk_tokens // tokens)
+            for start in range(0, len(sentence), size):
+                piece = sentence[start:start + size]
+                sentences.append((piece, self.count(piece)))
+        return sentences
+
+    def _pack(self, sentences):
+        chunks = []
+        current, current_tokens = [], 0
+        for sentence, tokens in sentences:
+            if current and current_tokens + tokens > self.chunk_tokens:
+                chunks.append("".join(text for text, _ in current))
+                # 下一段以前一段結尾的幾個句子開頭 (不超過 CHUNK_OVERLAP_TOKENS)
+                overlap, overlap_tokens = [], 0
+                for previous, previous_tokens in reversed(current):
+                    if overlap_tokens + previous_tokens > self.overlap_tokens:
+                        break
+                    overlap.insert(0, (previous, previous_tokens))
+                    overlap_tokens += previous_tokens
+                if overlap_tokens + tokens > self.chunk_tokens:
+                    overlap, overlap_tokens = [], 0
+                current, current_tokens = overlap, overlap_tokens
+            current.append((sentence, tokens))
+            current_tokens += tokens
+        if current:
+            chunks.append("".join(text for text, _ in current))
+        return chunks
+
+    def split_text(self, text):
+        results = []
+        for article, block in self._articles(text):
+            extra = {"article": article} if article else {}
+            for chunk in self._pack(self._sentences(block)):
+                chunk = chunk.strip()
+                if chunk:
+                    results.append((chunk, extra))
+        return results
+
+
+def get_chunker():
+    if get_chunker_name() == "sentence":
+        return SentenceChunker()
+    return RecursiveChunker()
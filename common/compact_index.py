@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import mmap
+from array import array
+import faiss
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from common.lexical_index import LexicalIndex
+
+# 目錄格式：
+#   index.faiss  FAISS 向量索引 (可 mmap)
+#   chunks.bin   每個段落一筆 JSON ({"text", "metadata"})，依索引位置排列
+#   chunks.idx   uint64 位移表，第 i 筆段落位於 [offsets[i], offsets[i+1])
+#   lexical.json 同一批段落的 BM25 倒排索引 (common/lexical_index.py)
+#   meta.json    格式版本與每個位置對應的 docstore id，最後寫入，代表整份索引已完成
+FORMAT_VERSION = 1
+INDEX_FILENAME = "index.faiss"
+CHUNKS_FILENAME = "chunks.bin"
+OFFSETS_FILENAME = "chunks.idx"
+META_FILENAME = "meta.json"
+
+
+class CompactDocstore(Docstore):
+    # 唯讀 docstore，段落內容透過 mmap 按需讀取，多個 process 可共用 page cache
+    def __init__(self, directory, ids):
+        self._positions = {doc_id: position for position, doc_id in enumerate(ids)}
+        self._offsets = array("Q")
+        with open(os.path.join(directory, OFFSETS_FILENAME), "rb") as f:
+            self._offsets.frombytes(f.read())
+
+        self._file = open(os.path.join(directory, CHUNKS_FILENAME), "rb")
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._mmap = b""
+
+    def __len__(self):
+        return len(self._positions)
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    def read(self, position):
+        record = json.loads(self._mmap[self._offsets[position]:self._offsets[position + 1]])
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    def search(self, search):
+        position = self._positions.get(search)
+        if position is None:
+            return f"ID {search} not found."
+        return self.read(position)
+
+
+def is_compact_index(directory):
+    meta_path = os.path.join(directory, META_FILENAME)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f).get("version") == FORMAT_VERSION
+
+
+def save_compact_index(docsearch, directory):
+    os.makedirs(directory, exist_ok=True)
+    # meta.json 最後寫入，讀取端看到新的 meta.json 時其他檔案都已經完成
+    ids = [docsearch.index_to_docstore_id[position] for position in range(docsearch.index.ntotal)]
+
+    offsets = array("Q", [0])
+    texts = []
+    chunks_tmp = os.path.join(directory, f"{CHUNKS_FILENAME}.tmp")
+    with open(chunks_tmp, "wb") as f:
+        for doc_id in ids:
+            document = docsearch.docstore.search(doc_id)
+            texts.append(document.page_content)
+            record = json.dumps({"text": document.page_content, "metadata": document.metadata}, ensure_ascii=False)
+            data = record.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+    offsets_tmp = os.path.join(directory, f"{OFFSETS_FILENAME}.tmp")
+    with open(offsets_tmp, "wb") as f:
+        f.write(offsets.tobytes())
+
+    index_tmp = os.path.join(directory, f"{INDEX_FILENAME}.tmp")
+    faiss.write_index(docsearch.index, index_tmp)
+
+    LexicalIndex.build(ids, texts).save(directory)
+
+    meta_tmp = os.path.join(directory, f"{META_FILENAME}.tmp")
+    with open(meta_tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": FORMAT_VERSION, "count": len(ids), "ids": ids}, f, ensure_ascii=False)
+
+    os.replace(chunks_tmp, os.path.join(directory, CHUNKS_FILENAME))
+    os.replace(offsets_tmp, os.path.join(directory, OFFSETS_FILENAME))
+    os.replace(index_tmp, os.path.join(directory, INDEX_FILENAME))
+    os.replace(meta_tmp, os.path.join(directory, META_FILENAME))
+
+
+def _read_faiss_index(path, use_mmap):
+    if use_mmap:
+        # 新版 faiss 的 IO_FLAG_MMAP_IFC 可以 mmap flat 索引，舊版只支援 IVF 的 inverted lists
+        for flag_name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+            flag = getattr(faiss, flag_name, None)
+            if flag is None:
+                continue
+            try:
+                return faiss.read_index(path, flag | getattr(faiss, "IO_FLAG_READ_ONLY", 0))
+            except RuntimeError:
+                continue
+    return faiss.read_index(path)
+
+
+def load_compact_index(directory, embeddings, mutable=False):
+    # mutable=False：向量 mmap、段落延遲讀取，適合唯讀的知識庫
+    # mutable=True：全部讀進記憶體，之後可以 add_texts / delete
+    with open(os.path.join(directory, META_FILENAME), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    ids = meta["ids"]
+    index = _read_faiss_index(os.path.join(directory, INDEX_FILENAME), use_mmap=not mutable)
+    index_to_docstore_id = dict(enumerate(ids))
+
+    if mutable:
+        chunks = CompactDocstore(directory, ids)
+        docstore = InMemoryDocstore({doc_id: chunks.read(position) for position, doc_id in enumerate(ids)})
+        chunks.close()
+    else:
+        docstore = CompactDocstore(directory, ids)
+
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def migrate_legacy_index(directory, embeddings):
+    # 舊版 save_local 的 index.pkl 需要 pickle 反序列化，只在轉檔時讀一次，轉完之後就不再使用
+    print(f"Converting legacy FAISS index in {directory} to the compact format")
+    docsearch = FAISS.load_local(directory, embeddings, allow_dangerous_deserialization=True)
+    save_compact_index(docsearch, directory)
+    return docsearch
+
+
+def load_or_migrate(directory, embeddings, mutable=False):
+    if not is_compact_index(directory) and os.path.exists(os.path.join(directory, "index.pkl")):
+        if os.getenv("LEGACY_INDEX_MIGRATION", "true").lower() != "true":
+            raise RuntimeError(f"{directory} is in the legacy pickle format and LEGACY_INDEX_MIGRATION is disabled")
+        migrate_legacy_index(directory, embeddings)
+    return load_compact_index(directory, embeddings, mutable=mutable)
+
+
+if __name__ == "__main__":
+    # python -m common.compact_index <目錄>：只轉換目錄中的舊格式索引 (不需要 embedding model)
+    for directory in sys.argv[1:]:
+        migrate_legacy_index(directory, None)
@@ -0,0 +1,142 @@
+import os
+import re
+import functools
+from langchain_core.documents import Document
+
+# 送進 LLM 前整理檢索內容：去掉重複與幾乎重複的段落，依排名放入，超過 token 預算的部分截斷
+# 預算 = min(CONTEXT_TOKEN_BUDGET, 模型 context window - 固定 prompt - 保留給回答的 token)
+
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "llama3:8b": 8192,
+    "llama3": 8192,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def get_token_budget():
+    return int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+
+
+def get_reserved_output_tokens():
+    return int(os.getenv("CONTEXT_RESERVED_OUTPUT_TOKENS", "512"))
+
+
+def get_dedup_threshold():
+    return float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.85"))
+
+
+def get_context_window(model_name):
+    if os.getenv("CONTEXT_WINDOW"):
+        return int(os.getenv("CONTEXT_WINDOW"))
+    if model_name in CONTEXT_WINDOWS:
+        return CONTEXT_WINDOWS[model_name]
+    # gpt-4o-2024-08-06 之類帶日期的名稱用最長的前綴比對
+    prefixes = [name for name in CONTEXT_WINDOWS if model_name.startswith(name)]
+    return CONTEXT_WINDOWS[max(prefixes, key=len)] if prefixes else DEFAULT_CONTEXT_WINDOW
+
+
+def estimate_tokens(text):
+    # 沒有 tokenizer 時的保守估計：中日文字元約 1.5 token，其他約 3 個字元 1 token
+    cjk = len(_CJK.findall(text))
+    return int(cjk * 1.5 + (len(text) - cjk) / 3) + 1
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(model_name):
+    # OpenAI 模型使用對應的 tiktoken 編碼，其他模型 (llama3 的 tokenizer 與 cl100k 相近) 使用 cl100k_base
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return estimate_tokens
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def _shingles(text, size=3):
+    text = _WHITESPACE.sub("", text)
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _is_near_duplicate(shingles, other):
+    # 重疊比例以較短的段落為準，被包含在另一段裡的段落也算重複
+    overlap = len(shingles & other)
+    return overlap / max(1, min(len(shingles), len(other))) >= get_dedup_threshold()
+
+
+def interleave(*ranked_lists):
+    # 多個來源各自已依相關度排序，輪流取各來源的第 1、第 2 ... 名
+    merged = []
+    for i in range(max((len(items) for items in ranked_lists), default=0)):
+        for items in ranked_lists:
+            if i < len(items):
+                merged.append(items[i])
+    return merged
+
+
+class ContextPacker:
+    def __init__(self, model_name, budget=None, reserved_output=None):
+        self.model_name = model_name
+        self.count = get_token_counter(model_name)
+        self.context_window = get_context_window(model_name)
+        self.budget = budget or get_token_budget()
+        self.reserved_output = reserved_output if reserved_output is not None else get_reserved_output_tokens()
+
+    def available(self, *fixed_texts, budget=None, reserved_output=None):
+        # 扣掉 prompt 中固定的部分與回答需要的空間後，還能放多少檢索內容
+        budget = budget or self.budget
+        reserved_output = reserved_output if reserved_output is not None else self.reserved_output
+        fixed = sum(self.count(text) for text in fixed_texts if text)
+        return max(0, min(budget, self.context_window - reserved_output - fixed))
+
+    def _truncate(self, text, tokens):
+        cut = int(len(text) * tokens / max(1, self.count(text)))
+        while cut > 0 and self.count(text[:cut]) > tokens:
+            cut = int(cut * 0.9)
+        return text[:cut]
+
+    def pack(self, chunks, budget=None, exclude=()):
+        # chunks 依重要性排序；回傳去重後、總 token 數不超過 budget 的段落 (最後一段可能被截斷)
+        budget = self.available() if budget is None else budget
+        selected = []
+        seen = [_shingles(text) for text in exclude if text]
+        used = 0
+
+        for chunk in chunks:
+            text = (chunk or "").strip()
+            if not text:
+                continue
+            shingles = _shingles(text)
+            if any(_is_near_duplicate(shingles, other) for other in seen):
+                continue
+
+            tokens = self.count(text)
+            if used + tokens > budget:
+                # 剩下的空間還夠放一小段時，把這一段截斷後放入
+                remaining = budget - used
+                if remaining >= 64:
+                    selected.append(self._truncate(text, remaining))
+                break
+
+            selected.append(text)
+            seen.append(shingles)
+            used += tokens
+
+        return selected
+
+    def pack_documents(self, documents, budget=None, exclude=()):
+        metadata = {document.page_content.strip(): document.metadata for document in documents}
+        return [Document(page_content=text, metadata=metadata.get(text, {}))
+                for text in self.pack([document.page_content for document in documents], budget, exclude)]
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import threading
+from array import array
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from common.answer_cache import hash_text
+
+# SQLite 一次查詢的參數數量有上限，批次查詢時分段處理
+_BATCH_SIZE = 500
+
+
+class EmbeddingStore:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT,
+                    hash TEXT,
+                    vector BLOB,
+                    PRIMARY KEY (model, hash)
+                )
+            """)
+
+    def get_many(self, model, hashes):
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), _BATCH_SIZE):
+                batch = hashes[start:start + _BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch],
+                )
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model, items):
+        rows = [(model, text_hash, array("f", vector).tobytes()) for text_hash, vector in items]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+
+    def count(self, model=None):
+        with self._lock:
+            if model is None:
+                return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)).fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    # 包在原本的 embedding model 外面，只把快取中沒有的文字送去做 embedding
+    def __init__(self, embeddings, model_name, store):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, namespace, texts, embed_fn):
+        hashes = [hash_text(text) for text in texts]
+        found = self.store.get_many(namespace, list(set(hashes)))
+
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in found:
+                missing.setdefault(text_hash, text)
+
+        self.hits += len(texts) - sum(1 for text_hash in hashes if text_hash in missing)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.store.put_many(namespace, new_items)
+            found.update(new_items)
+
+        return [list(found[text_hash]) for text_hash in hashes]
+
+    def embed_documents(self, texts):
+        return self._embed(self.model_name, texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        # 部分模型 (例如 FastEmbed) 的 query 與 passage 向量不同，分開存放
+        return self._embed(f"{self.model_name}:query", [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def embed_queries(self, texts):
+        return self._embed(f"{self.model_name}:query", texts, lambda texts: batch_embed_queries(self.embeddings, texts))
+
+
+# 查詢向量與文件向量相同的模型，多個查詢可以直接用 embed_documents 一次送出
+_QUERY_IS_DOCUMENT = {"OpenAIEmbeddings", "AzureOpenAIEmbeddings", "FakeEmbeddings"}
+
+
+def batch_embed_queries(embeddings, texts):
+    # 一次完成多個查詢的 embedding (一次 API 請求 / 一次模型推論)
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings.embed_queries(texts)
+    if type(embeddings).__name__ in _QUERY_IS_DOCUMENT:
+        return embeddings.embed_documents(texts)
+    model = getattr(embeddings, "_model", None)
+    if hasattr(model, "query_embed"):
+        # FastEmbed 的查詢有專用的前綴，改用 query_embed 批次處理
+        return [vector.tolist() for vector in model.query_embed(texts)]
+    return [embeddings.embed_query(text) for text in texts]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(path=None):
+    load_dotenv()
+    path = path or os.getenv("EMBEDDING_CACHE_PATH", "../cache/embeddings.sqlite")
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = EmbeddingStore(path)
+        return _stores[path]
+
+
+def cached_embeddings(embeddings):
+    # EMBEDDING_CACHE=false 時直接回傳原本的 embedding model
+    load_dotenv()
+    if os.getenv("EMBEDDING_CACHE", "true").lower() != "true":
+        return embeddings
+    model_name = getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None) or type(embeddings).__name__
+    return CachedEmbeddings(embeddings, f"{type(embeddings).__name__}:{model_name}", get_embedding_store())
@@ -0,0 +1,127 @@
+import os
+import re
+import json
+import math
+import time
+import zlib
+import asyncio
+import hashlib
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# 離線測試與 benchmark 用的假模型：不需要 OpenAI 金鑰或 Ollama，輸出固定，可設定人工延遲
+
+
+def fake_models_enabled():
+    return os.getenv("FAKE_MODELS", "false").lower() == "true"
+
+
+def _split_tokens(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class FakeEmbeddings(Embeddings):
+    # 以字元 bigram 的 hashing trick 產生向量，相似的文字會得到相近的向量
+    def __init__(self, dim=384, latency=0.0, latency_per_text=0.0):
+        self.model_name = f"fake-bigram-{dim}"
+        self.dim = dim
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            dim=int(os.getenv("FAKE_EMBEDDING_DIM", "384")),
+            latency=float(os.getenv("FAKE_EMBEDDING_LATENCY", "0")),
+            latency_per_text=float(os.getenv("FAKE_EMBEDDING_LATENCY_PER_TEXT", "0")),
+        )
+
+    def _vector(self, text):
+        vector = [0.0] * self.dim
+        text = re.sub(r"\s+", "", text)
+        for i in range(len(text) - 1):
+            bucket = zlib.crc32(text[i:i + 2].encode("utf-8"))
+            vector[bucket % self.dim] += 1.0 if bucket & 0x80000000 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def _sleep(self, count):
+        delay = self.latency + self.latency_per_text * count
+        if delay:
+            time.sleep(delay)
+
+    def embed_documents(self, texts):
+        self._sleep(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self._sleep(1)
+        return self._vector(text)
+
+
+class FakeChatModel(BaseChatModel):
+    # 回答由 prompt 決定 (雜湊 + prompt 結尾的文字)，延遲 = latency + 輸出字數 / tokens_per_second
+    model_name: str = "fake-chat"
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    answer_chars: int = 200
+    json_output: bool = False
+
+    @classmethod
+    def from_env(cls, json_output=False):
+        return cls(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0")),
+            tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "0")),
+            json_output=json_output,
+        )
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    @property
+    def model(self):
+        return self.model_name
+
+    def _answer(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        body = re.sub(r"\s+", " ", prompt)[-self.answer_chars:]
+        if self.json_output:
+            # 對 prompt 中每個編號的問題 ("1. ...") 各給一個答案
+            numbers = re.findall(r"^(\d+)\. ", prompt, re.M)
+            return prompt, json.dumps({number: f"[{digest}] {body}" for number in numbers}, ensure_ascii=False)
+        return prompt, f"[{digest}] {body}"
+
+    def _token_delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _message(self, prompt, text):
+        usage = {"input_tokens": len(prompt), "output_tokens": len(text), "total_tokens": len(prompt) + len(text)}
+        return AIMessage(content=text, usage_metadata=usage)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt, text = self._answer(messages)
+        time.sleep(self.latency + self._token_delay() * len(_split_tokens(text)))
+        return ChatResult(generations=[ChatGeneration(message=self._message(prompt, text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt, text = self._answer(messages)
+        await asyncio.sleep(self.latency + self._token_delay() * len(_split_tokens(text)))
+        return ChatResult(generations=[ChatGeneration(message=self._message(prompt, text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        _, text = self._answer(messages)
+        time.sleep(self.latency)
+        for token in _split_tokens(text):
+            time.sleep(self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        _, text = self._answer(messages)
+        await asyncio.sleep(self.latency)
+        for token in _split_tokens(text):
+            await asyncio.sleep(self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
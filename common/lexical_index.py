@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import math
+import unicodedata
+from collections import Counter
+from typing import Any
+from langchain_core.retrievers import BaseRetriever
+from common.ann_index import search_batch
+from common.embedding_cache import batch_embed_queries
+
+# 中文 BM25 倒排索引，與 FAISS 索引放在同一個目錄 (lexical.json)、使用同樣的段落
+# 以相鄰字元 (英數字連續字串視為一個字元) 的 bigram 為詞，不需要斷詞字典，「授信」、「第12條」都能精確比對
+# RETRIEVAL_MODE：vector (預設) 只用 FAISS，lexical 只用 BM25，hybrid 以 RRF 融合兩者的排名，
+# hybrid 時若 BM25 第一名已包含查詢的所有詞，直接回傳 BM25 結果，不呼叫 embedding model
+
+LEXICAL_FILENAME = "lexical.json"
+LEXICAL_VERSION = 1
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+RRF_K = 60
+
+_UNIT_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]|[0-9a-z]+")
+
+
+def get_retrieval_mode():
+    mode = os.getenv("RETRIEVAL_MODE", "vector")
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown RETRIEVAL_MODE: {mode} (expected one of {', '.join(RETRIEVAL_MODES)})")
+    return mode
+
+
+def get_fast_path_coverage():
+    # BM25 第一名涵蓋查詢詞 (以 idf 加權) 的比例達到這個值時，hybrid 模式略過向量檢索
+    return float(os.getenv("LEXICAL_FAST_PATH_COVERAGE", "1.0"))
+
+
+def tokenize(text):
+    # 全形轉半形、轉小寫後切成字元單位，被空白或標點隔開的單位不組成 bigram，只有一個單位的片段保留 unigram
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    run = []
+    previous_end = None
+    for match in _UNIT_RE.finditer(text):
+        if previous_end is not None and match.start() != previous_end:
+            tokens.extend(_run_tokens(run))
+            run = []
+        run.append(match.group())
+        previous_end = match.end()
+    tokens.extend(_run_tokens(run))
+    return tokens
+
+
+def _run_tokens(run):
+    if len(run) == 1:
+        return run
+    return [run[i] + run[i + 1] for i in range(len(run) - 1)]
+
+
+class LexicalIndex:
+    def __init__(self, ids, lengths, postings, k1=1.5, b=0.75):
+        # postings：詞 -> [[段落位置, 詞頻], ...]，查詢時只需把預先算好的權重加總
+        self.ids = ids
+        self.lengths = lengths
+        self.postings = postings
+        count = len(ids)
+        average = sum(lengths) / count if count else 0.0
+        self._missing_idf = math.log(1 + (count + 0.5) / 0.5)
+        self._idf = {}
+        self._weights = {}
+        for term, entries in postings.items():
+            idf = math.log(1 + (count - len(entries) + 0.5) / (len(entries) + 0.5))
+            self._idf[term] = idf
+            self._weights[term] = [
+                (position, idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[position] / average)))
+                for position, tf in entries
+            ]
+
+    @classmethod
+    def build(cls, ids, texts):
+        lengths = []
+        postings = {}
+        for position, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append([position, tf])
+        return cls(list(ids), lengths, postings)
+
+    @classmethod
+    def from_docsearch(cls, docsearch):
+        ids = docstore_ids(docsearch)
+        return cls.build(ids, [docsearch.docstore.search(doc_id).page_content for doc_id in ids])
+
+    def search(self, query, k):
+        # 回傳 ([(docstore id, 分數)], 第一名涵蓋查詢詞的比例)
+        terms = set(tokenize(query))
+        if not terms:
+            return [], 0.0
+        scores = Counter()
+        matched = Counter()
+        for term in terms:
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for position, weight in self._weights[term]:
+                scores[position] += weight
+                matched[position] += idf
+        if not scores:
+            return [], 0.0
+        top = scores.most_common(k)
+        total_idf = sum(self._idf.get(term, self._missing_idf) for term in terms)
+        return [(self.ids[position], score) for position, score in top], matched[top[0][0]] / total_idf
+
+    def save(self, directory):
+        path = os.path.join(directory, LEXICAL_FILENAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": LEXICAL_VERSION, "ids": self.ids, "lengths": self.lengths,
+                       "postings": self.postings}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def docstore_ids(docsearch):
+    return [docsearch.index_to_docstore_id[position] for position in range(docsearch.index.ntotal)]
+
+
+def load_lexical_index(directory, docsearch):
+    # 與 FAISS 索引的段落不一致 (舊索引、或索引在記憶體中被修改過) 時重新建立，能寫入時順便存檔
+    path = os.path.join(directory, LEXICAL_FILENAME)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == LEXICAL_VERSION and data["ids"] == docstore_ids(docsearch):
+            return LexicalIndex(data["ids"], data["lengths"], data["postings"])
+
+    index = LexicalIndex.from_docsearch(docsearch)
+    try:
+        index.save(directory)
+    except OSError as e:
+        print(f"Lexical index not saved to {directory}: {e}")
+    return index
+
+
+def rrf_fuse(ranked_lists, k):
+    # Reciprocal Rank Fusion，以段落內容判斷是否為同一段
+    scores = {}
+    documents = {}
+    for ranked in ranked_lists:
+        for rank, document in enumerate(ranked):
+            key = document.page_content
+            documents.setdefault(key, document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+    ranked_keys = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in ranked_keys]
+
+
+def hybrid_search(docsearch, lexical, embeddings, queries, k, mode=None):
+    # 依 RETRIEVAL_MODE 檢索多個查詢，需要向量檢索的查詢一起 embedding、一次矩陣搜尋
+    mode = mode or get_retrieval_mode()
+    if mode == "vector" or lexical is None:
+        return search_batch(docsearch, batch_embed_queries(embeddings, queries), k)
+
+    lexical_results = []
+    fast = []
+    for query in queries:
+        hits, coverage = lexical.search(query, k)
+        lexical_results.append([docsearch.docstore.search(doc_id) for doc_id, _ in hits])
+        fast.append(bool(hits) and coverage >= get_fast_path_coverage())
+    if mode == "lexical":
+        return lexical_results
+
+    results = list(lexical_results)
+    slow = [i for i, is_fast in enumerate(fast) if not is_fast]
+    if slow:
+        vectors = batch_embed_queries(embeddings, [queries[i] for i in slow])
+        for i, documents in zip(slow, search_batch(docsearch, vectors, k)):
+            results[i] = rrf_fuse([lexical_results[i], documents], k)
+    return results
+
+
+class HybridRetriever(BaseRetriever):
+    # 給 ChatBot 使用的 retriever，RETRIEVAL_MODE 為 lexical / hybrid 時取代 FAISS 的 as_retriever()
+    docsearch: Any
+    lexical: Any
+    k: int = 3
+    mode: str = "hybrid"
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return hybrid_search(self.docsearch, self.lexical, self.docsearch.embeddings, [query], self.k, self.mode)[0]
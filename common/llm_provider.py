@@ -0,0 +1,399 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from common.fakes import fake_models_enabled, FakeChatModel
+
+# 後端與 ChatBot 共用的 LLM 建立方式，LLM_PROVIDER 選擇 openai / ollama / fake (FAKE_MODELS=true 時一律為 fake)
+# 同一個 process 內每種設定只建立一個 client，所有呼叫共用：
+#   - keep-alive 連線池 (OpenAI 用 httpx.Client，Ollama 用 requests.Session)
+#   - 限流：每秒請求數的 token bucket (LLM_REQUESTS_PER_SECOND / LLM_BURST) 與同時進行的請求上限 (LLM_MAX_IN_FLIGHT)
+#   - 429 / 5xx / 連線錯誤以指數退避重試 (LLM_MAX_RETRIES，有 Retry-After 時依照伺服器指定的時間)
+# 非同步呼叫在 thread 中執行同步版本，每份報告各自的 asyncio event loop 也能共用同一個連線池
+# Ollama 的請求都帶 keep_alive (OLLAMA_KEEP_ALIVE)，模型不會在報告之間被卸載
+# 呼叫端可用 call_deadline() 設定期限：期限到了不再等待名額或重試，HTTP 請求的 timeout 也縮短到剩下的時間
+
+PROVIDERS = ("openai", "ollama", "fake")
+RETRY_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+MAX_RETRY_DELAY = 60.0
+
+_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+_RETRY_ERRORS = {"APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout", "ReadTimeout",
+                 "RemoteProtocolError", "ConnectionError", "Timeout"}
+
+_models = {}
+_gates = {}
+_lock = threading.Lock()
+_http_clients = {}
+# asyncio.to_thread 會把 contextvars 帶進 thread，期限對 thread 中的同步呼叫也有效
+_deadline = contextvars.ContextVar("llm_call_deadline", default=None)
+
+
+def get_llm_provider(default):
+    if fake_models_enabled():
+        return "fake"
+    provider = os.getenv("LLM_PROVIDER") or default
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM_PROVIDER: {provider} (expected one of {', '.join(PROVIDERS)})")
+    return provider
+
+
+def get_llm_max_connections():
+    return int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+
+
+def get_llm_max_in_flight():
+    # 0 表示不限制
+    return int(os.getenv("LLM_MAX_IN_FLIGHT", "16"))
+
+
+def get_llm_requests_per_second():
+    # 0 表示不限制
+    return float(os.getenv("LLM_REQUESTS_PER_SECOND", "0"))
+
+
+def get_llm_burst():
+    return int(os.getenv("LLM_BURST", "0")) or max(1, int(get_llm_requests_per_second()))
+
+
+def get_llm_max_retries():
+    return int(os.getenv("LLM_MAX_RETRIES", "4"))
+
+
+def get_llm_retry_base_delay():
+    return float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+
+
+def get_llm_timeout():
+    return float(os.getenv("LLM_TIMEOUT", "120"))
+
+
+def get_openai_model():
+    # 沒有設定時使用 langchain_openai 的預設模型
+    return os.getenv("OPENAI_MODEL")
+
+
+def get_ollama_model():
+    return os.getenv("OLLAMA_MODEL", "llama3:8b")
+
+
+def get_ollama_base_url():
+    return os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
+
+
+def get_ollama_keep_alive():
+    return os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+
+@contextmanager
+def call_deadline(seconds):
+    # seconds 為 None 或 0 時不設期限；巢狀設定時取較早的期限
+    deadline = _deadline.get()
+    if seconds:
+        deadline = min(filter(None, (deadline, time.monotonic() + seconds)))
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _remaining():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class TokenBucket:
+    # 每秒補充 rate 個 token，最多累積 burst 個；rate <= 0 表示不限制
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        # 先預約一個 token (可以預支成負數)，再睡到輪到自己為止，同時等待的請求依序放行
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class CallGate:
+    # 同一個 provider 的所有 client 共用：先取得同時請求的名額，再從 token bucket 取得發送的許可
+    def __init__(self, requests_per_second, burst, max_in_flight):
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+
+    @contextmanager
+    def slot(self, timeout=None):
+        # timeout 是呼叫期限剩下的時間，等不到名額時放棄
+        if self.slots is not None and not self.slots.acquire(timeout=None if timeout is None else max(0, timeout)):
+            raise TimeoutError("LLM call deadline exceeded while waiting for a free slot")
+        try:
+            self.bucket.acquire()
+            yield
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+
+def _get_gate(provider):
+    with _lock:
+        if provider not in _gates:
+            _gates[provider] = CallGate(get_llm_requests_per_second(), get_llm_burst(), get_llm_max_in_flight())
+        return _gates[provider]
+
+
+def _status_code(error):
+    for source in (error, getattr(error, "response", None)):
+        status = getattr(source, "status_code", None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_retryable(error):
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRY_STATUS
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in _RETRY_ERRORS
+
+
+def retry_delay(error, attempt):
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(MAX_RETRY_DELAY, float(retry_after))
+        except ValueError:
+            pass
+    # 指數退避加上隨機抖動，避免同時失敗的請求又同時重試
+    return min(MAX_RETRY_DELAY, get_llm_retry_base_delay() * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def get_openai_http_client():
+    # OpenAI 的 chat 與 embedding client 共用同一個 keep-alive 連線池
+    import httpx
+    with _lock:
+        if "openai" not in _http_clients:
+            limits = httpx.Limits(max_connections=get_llm_max_connections(),
+                                  max_keepalive_connections=get_llm_max_connections(), keepalive_expiry=60)
+            _http_clients["openai"] = httpx.Client(limits=limits, timeout=get_llm_timeout())
+        return _http_clients["openai"]
+
+
+def get_ollama_session():
+    with _lock:
+        if "ollama" not in _http_clients:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=get_llm_max_connections())
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_clients["ollama"] = session
+        return _http_clients["ollama"]
+
+
+class OllamaChatModel(BaseChatModel):
+    # 直接呼叫 Ollama 的 /api/chat，透過共用的 requests.Session 重複使用連線，每個請求都帶 keep_alive
+    model_name: str = "llama3:8b"
+    base_url: str = "http://localhost:11434"
+    keep_alive: str = "30m"
+    format: Optional[str] = None
+    timeout: float = 120.0
+
+    @property
+    def _llm_type(self):
+        return "ollama-chat"
+
+    @property
+    def model(self):
+        return self.model_name
+
+    def _payload(self, messages, stop, stream):
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": _ROLES.get(message.type, "user"), "content": message.content} for message in messages],
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+        }
+        if self.format:
+            payload["format"] = self.format
+        if stop:
+            payload["options"] = {"stop": stop}
+        return payload
+
+    def _post(self, payload, stream, timeout=None):
+        response = get_ollama_session().post(f"{self.base_url}/api/chat", json=payload, stream=stream,
+                                             timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _metadata(data):
+        # 與 ChatOllama 相同的欄位，tracing.llm_usage 以 prompt_eval_count / eval_count 計算 token
+        return {key: data[key] for key in ("model", "prompt_eval_count", "eval_count", "total_duration", "load_duration")
+                if key in data}
+
+    def _generate(self, messages, stop=None, run_manager=None, timeout=None, **kwargs):
+        data = self._post(self._payload(messages, stop, False), False, timeout).json()
+        message = AIMessage(content=data["message"]["content"], response_metadata=self._metadata(data))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, timeout=None, **kwargs):
+        with self._post(self._payload(messages, stop, True), True, timeout) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise ValueError(f"Ollama error: {data['error']}")
+                metadata = self._metadata(data) if data.get("done") else {}
+                content = data.get("message", {}).get("content", "")
+                yield ChatGenerationChunk(message=AIMessageChunk(content=content, response_metadata=metadata))
+
+    def warm_up(self):
+        # 沒有訊息的請求只會載入模型並設定 keep_alive
+        self._post({"model": self.model_name, "messages": [], "keep_alive": self.keep_alive}, False)
+
+
+class ProviderChatModel(BaseChatModel):
+    # 包裝實際的 chat model：每次呼叫經過限流，可重試的錯誤自動重試
+    client: Any
+    gate: Any
+    provider: str
+    model_name: str
+
+    @property
+    def _llm_type(self):
+        return f"provider-{self.provider}"
+
+    @property
+    def model(self):
+        return self.model_name
+
+    def _call_kwargs(self, kwargs):
+        # 有期限時 HTTP 請求的 timeout 不超過剩下的時間 (ChatOpenAI 會把 timeout 傳給 SDK 的 create())
+        remaining = _remaining()
+        if remaining is None:
+            return kwargs
+        if remaining <= 0:
+            raise TimeoutError("LLM call deadline exceeded")
+        if self.provider == "fake":
+            return kwargs
+        return dict(kwargs, timeout=min(get_llm_timeout(), remaining))
+
+    def _retry(self, error, attempt):
+        if attempt >= get_llm_max_retries() or not is_retryable(error):
+            raise error
+        delay = retry_delay(error, attempt)
+        remaining = _remaining()
+        if remaining is not None and remaining <= delay:
+            raise error
+        print(f"LLM call failed ({type(error).__name__}: {error}), retry {attempt + 1} in {delay:.1f}s")
+        time.sleep(delay)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                with self.gate.slot(_remaining()):
+                    return self.client._generate(messages, stop=stop, **self._call_kwargs(kwargs))
+            except Exception as e:
+                self._retry(e, attempt)
+                attempt += 1
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        attempt = 0
+        while True:
+            started = False
+            try:
+                with self.gate.slot(_remaining()):
+                    for chunk in self.client._stream(messages, stop=stop, **self._call_kwargs(kwargs)):
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                # 已經送出部分內容時不能重試
+                if started:
+                    raise
+                self._retry(e, attempt)
+                attempt += 1
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return await asyncio.to_thread(self._generate, messages, stop, None, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        chunks = self._stream(messages, stop, None, **kwargs)
+        done = object()
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+
+
+def _create_client(provider, json_output):
+    if provider == "fake":
+        return FakeChatModel.from_env(json_output)
+    if provider == "ollama":
+        return OllamaChatModel(model_name=get_ollama_model(), base_url=get_ollama_base_url(),
+                               keep_alive=get_ollama_keep_alive(), format="json" if json_output else None,
+                               timeout=get_llm_timeout())
+
+    from langchain_openai import ChatOpenAI
+    kwargs = {"model": get_openai_model()} if get_openai_model() else {}
+    if json_output:
+        kwargs["model_kwargs"] = {"response_format": {"type": "json_object"}}
+    # 重試由 ProviderChatModel 處理，避免 SDK 內建的重試次數相乘
+    return ChatOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=get_openai_http_client(), max_retries=0,
+                      timeout=get_llm_timeout(), **kwargs)
+
+
+def get_chat_model(default_provider, json_output=False):
+    # default_provider 是沒有設定 LLM_PROVIDER 時使用的 provider (openai 版本為 openai，llama 版本為 ollama)
+    provider = get_llm_provider(default_provider)
+    key = (provider, json_output)
+    with _lock:
+        model = _models.get(key)
+    if model is None:
+        client = _create_client(provider, json_output)
+        model = ProviderChatModel(client=client, gate=_get_gate(provider), provider=provider,
+                                  model_name=client.model_name)
+        with _lock:
+            model = _models.setdefault(key, model)
+    return model
+
+
+def warm_up_llm_in_background(default_provider):
+    # Ollama 在服務啟動時先載入模型，第一份報告不用等模型載入
+    if get_llm_provider(default_provider) != "ollama":
+        return None
+
+    def run():
+        try:
+            get_chat_model(default_provider).client.warm_up()
+            print(f"Ollama model {get_ollama_model()} loaded (keep_alive={get_ollama_keep_alive()})")
+        except Exception as e:
+            print(f"Ollama warm up failed: {e}")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
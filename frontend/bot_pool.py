@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+
+def estimate_bot_size(bot):
+    # 粗估單一 ConversationBot 佔用的記憶體 (向量 + 文件文字 + 對話紀錄)
+    size = 0
+    docs = getattr(bot, "docs", None)
+    if docs is not None:
+        index = docs.index
+        size += index.ntotal * index.d * 4
+        for document in getattr(docs.docstore, "_dict", {}).values():
+            size += len(document.page_content.encode("utf-8"))
+    for text in list(bot.conversations) + list(bot.info):
+        size += len(str(text).encode("utf-8"))
+    return size
+
+
+class BotPool:
+    def __init__(self, bot_factory, max_sessions=None, max_memory_mb=None):
+        load_dotenv()
+
+        self.bot_factory = bot_factory
+        self.max_sessions = max_sessions or int(os.getenv("BOT_POOL_MAX_SESSIONS", "16"))
+        max_memory_mb = max_memory_mb or float(os.getenv("BOT_POOL_MAX_MEMORY_MB", "512"))
+        self.max_memory = int(max_memory_mb * 1024 * 1024)
+
+        self._bots = OrderedDict()
+        self._sizes = {}
+        self._session_locks = {}
+        self._lock = threading.Lock()
+
+    def _session_lock(self, session_id):
+        with self._lock:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def _evict(self):
+        # 依照 LRU 順序淘汰，最少保留最近使用的那一個
+        while len(self._bots) > 1 and (
+            len(self._bots) > self.max_sessions or sum(self._sizes.values()) > self.max_memory
+        ):
+            session_id, _ = self._bots.popitem(last=False)
+            self._sizes.pop(session_id, None)
+            self._session_locks.pop(session_id, None)
+
+    def get(self, session_id):
+        # 同一個 session 只建一次 bot，其他 session 不會被建立中的 bot 卡住
+        with self._session_lock(session_id):
+            with self._lock:
+                bot = self._bots.get(session_id)
+                if bot is not None:
+                    self._bots.move_to_end(session_id)
+                    return bot
+
+            bot = self.bot_factory()
+
+            with self._lock:
+                self._bots[session_id] = bot
+                self._sizes[session_id] = estimate_bot_size(bot)
+                self._evict()
+            return bot
+
+    def ask(self, session_id, query):
+        bot = self.get(session_id)
+        with self._session_lock(session_id):
+            # 上傳資料夾有變動時只同步差異的頁面
+            bot.refresh()
+            answer = bot.start_process(query)
+            with self._lock:
+                if session_id in self._sizes:
+                    self._sizes[session_id] = estimate_bot_size(bot)
+                    self._evict()
+        return answer
+
+    def stream(self, session_id, query):
+        bot = self.get(session_id)
+        with self._session_lock(session_id):
+            bot.refresh()
+            yield from bot.stream_process(query)
+            with self._lock:
+                if session_id in self._sizes:
+                    self._sizes[session_id] = estimate_bot_size(bot)
+                    self._evict()
+
+    def discard(self, session_id):
+        with self._lock:
+            self._bots.pop(session_id, None)
+            self._sizes.pop(session_id, None)
+            self._session_locks.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._bots)
@@ -1,52 +1,68 @@
 import os
+import sys
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_community.chat_models import ChatOllama
-from langchain_community.vectorstores import FAISS
+from index_manifest import load_indexed, sync_faiss_index, has_changes
 from langchain_community.embeddings import FastEmbedEmbeddings
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.answer_cache import get_answer_cache, hash_text
+from common.embedding_cache import cached_embeddings
+from common.fakes import fake_models_enabled, FakeEmbeddings
+from common.llm_provider import get_chat_model
+from common.context_packer import ContextPacker
+from common.lexical_index import HybridRetriever, get_retrieval_mode, load_lexical_index
+
+NO_DOCUMENTS_ANSWER = "我不太清楚，請更詳細描述問題或自行查看報告內容"
+
 class ConversationBot:
     def __init__(self):
         load_dotenv()
 
         self.OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-        self.embeddings = FastEmbedEmbeddings()
+        if fake_models_enabled():
+            self.embeddings = cached_embeddings(FakeEmbeddings.from_env())
+        else:
+            self.embeddings = cached_embeddings(FastEmbedEmbeddings())
         self.conversations = []
         self.info = []
+        self.answer_cache = get_answer_cache()
 
-        self._build_faiss_index(self.embeddings)
-        self.docs = self._load_faiss_index(self.embeddings)
-        self.rag_chain = self._create_rag_chain(self.docs)
-
+        self.docs, self.manifest = self._build_faiss_index(self.embeddings)
+        self.retriever, self.question_answer_chain = self._create_rag_chain(self.docs)
 
-    def _load_documents(self, documents_path="../upload/"):
-        documents = []
-        for filename in os.listdir(documents_path):
-            if filename.endswith(".pdf"):
-                loader = PyPDFLoader(os.path.join(documents_path, filename))
-                pages = loader.load_and_split()
-                documents.extend(page.page_content for page in pages)
-        return documents
 
-    def _build_faiss_index(self, embeddings, save_path="./faiss_index"):
-        documents = self._load_documents()
+    def _build_faiss_index(self, embeddings, documents_path="../upload/", save_path="./faiss_index"):
+        # 只對新增或修改過的頁面做 embedding，刪除的檔案會從索引移除
+        docsearch, manifest = load_indexed(embeddings, save_path)
+        docsearch, manifest, _ = sync_faiss_index(docsearch, manifest, embeddings, documents_path, save_path)
 
-        docsearch = FAISS.from_texts(documents, embeddings)
-        docsearch.save_local(save_path)
+        return docsearch, manifest
 
-    def _load_faiss_index(self, embeddings, save_path="./faiss_index"):
-        return FAISS.load_local(save_path, embeddings, allow_dangerous_deserialization=True)
+    def refresh(self, documents_path="../upload/", save_path="./faiss_index"):
+        if not has_changes(self.manifest, documents_path):
+            return False
 
-    def _create_retriever(self, doc, k=3):
+        self.docs, self.manifest, changed = sync_faiss_index(
+            self.docs, self.manifest, self.embeddings, documents_path, save_path
+        )
+        if changed:
+            self.retriever, self.question_answer_chain = self._create_rag_chain(self.docs)
+        return changed
+
+    def _create_retriever(self, doc, k=3, save_path="./faiss_index"):
+        # lexical / hybrid 模式時使用與 FAISS 索引同目錄的 BM25 索引，完全命中的查詢不需要 embedding
+        mode = get_retrieval_mode()
+        if mode != "vector":
+            return HybridRetriever(docsearch=doc, lexical=load_lexical_index(save_path, doc), k=k, mode=mode)
         retriever = doc.as_retriever(search_type='similarity', search_kwargs={'k': k})
 
         return retriever
 
     def _create_llm(self):
-        return ChatOllama(model="llama3:8b")
+        # 所有 bot 共用同一個 client (連線池、限流、重試與 keep_alive)
+        return get_chat_model("ollama")
 
     def _initialize_prompt(self):
         system_prompt = """
@@ -73,15 +89,21 @@ class ConversationBot:
         return prompt
 
     def _create_rag_chain(self, docs):
-        retriever = self._create_retriever(docs)
+        # ../upload/ 還沒有任何 PDF 時沒有索引，等 refresh() 找到第一份文件再建立 retriever
+        retriever = self._create_retriever(docs) if docs is not None else None
         llm = self._create_llm()
         prompt = self._initialize_prompt()
         question_answer_chain = create_stuff_documents_chain(llm, prompt)
-        rag_chain = create_retrieval_chain(retriever, question_answer_chain)
 
-        return rag_chain
+        # 檢索與回答分開執行，才能用檢索結果判斷是否命中回答快取
+        self.llm_name = llm.model
+        self.template_version = hash_text(prompt.pretty_repr())[:12]
+        self.prompt_text = prompt.pretty_repr()
+        self.packer = ContextPacker(self.llm_name)
+
+        return retriever, question_answer_chain
 
-    def _retrieve_answers(self, query, rag_chain):
+    def _build_question(self, query, info):
         conversation = self.conversations
 
         question = f"""
@@ -89,26 +111,94 @@ class ConversationBot:
 {conversation}
 
 # 上一個對話的資料
-{self.info}
+{info}
 
 # 問題
 {query}
 """
-        result = rag_chain.invoke({"input": question})
+        return question
+
+    def _prepare(self, query):
+        # 檢索用完整的問題；送進 LLM 前去掉上一輪資料中與這次檢索結果重複的段落，兩者合計不超過 token 預算
+        documents = self.retriever.invoke(self._build_question(query, self.info))
 
-        self.info = [document.page_content for document in result['context']]
-        answer = result['answer']
+        budget = self.packer.available(self.prompt_text, self._build_question(query, []))
+        documents = self.packer.pack_documents(documents, budget)
+        used = sum(self.packer.count(document.page_content) for document in documents)
+        info = self.packer.pack(self.info, budget - used, exclude=[document.page_content for document in documents])
 
-        while len(conversation) > 4:
+        return self._build_question(query, info), documents
+
+    def _remember(self, query, answer, documents):
+        self.info = [document.page_content for document in documents]
+
+        while len(self.conversations) > 4:
             self.conversations.pop(0)
 
         self.conversations.append(query)
         self.conversations.append(answer)
 
+    def _lookup_cache(self, query, question, documents):
+        # 先比對完全相同的問題，沒有的話再用問題向量找相近的問題
+        if self.answer_cache is None:
+            return None, None, None
+
+        context_hash = hash_text("\n".join(document.page_content for document in documents))
+        answer = self.answer_cache.get(self.llm_name, self.template_version, question, context_hash)
+
+        embedding = None
+        if answer is None and self.answer_cache.similarity:
+            embedding = self.embeddings.embed_query(query)
+            answer = self.answer_cache.get_similar(self.llm_name, self.template_version, context_hash, embedding)
+
+        return answer, context_hash, embedding
+
+    def _store_cache(self, question, context_hash, answer, embedding):
+        if self.answer_cache is not None:
+            self.answer_cache.put(self.llm_name, self.template_version, question, context_hash, answer, embedding)
+
+    def _retrieve_answers(self, query):
+        if self.retriever is None:
+            self._remember(query, NO_DOCUMENTS_ANSWER, [])
+            return NO_DOCUMENTS_ANSWER
+
+        question, documents = self._prepare(query)
+
+        answer, context_hash, embedding = self._lookup_cache(query, question, documents)
+        if answer is None:
+            answer = self.question_answer_chain.invoke({"input": question, "context": documents})
+            self._store_cache(question, context_hash, answer, embedding)
+
+        self._remember(query, answer, documents)
+
         return answer
 
+    def _stream_answers(self, query):
+        # 逐步回傳目前為止的答案，串流結束後才更新對話紀錄
+        if self.retriever is None:
+            self._remember(query, NO_DOCUMENTS_ANSWER, [])
+            yield NO_DOCUMENTS_ANSWER
+            return
+
+        question, documents = self._prepare(query)
+
+        answer, context_hash, embedding = self._lookup_cache(query, question, documents)
+        if answer is not None:
+            yield answer
+        else:
+            answer = ""
+            for chunk in self.question_answer_chain.stream({"input": question, "context": documents}):
+                answer += chunk
+                yield answer
+            self._store_cache(question, context_hash, answer, embedding)
+
+        self._remember(query, answer, documents)
+
 
     def start_process(self, query):
-        answer = self._retrieve_answers(query, self.rag_chain)
+        answer = self._retrieve_answers(query)
 
         return answer
+
+    def stream_process(self, query):
+        yield from self._stream_answers(query)
@@ -1,11 +1,15 @@
 import requests
 import gradio as gr
 from chatbot_llama import ConversationBot
+from bot_pool import BotPool
+from report_stream import ReportView, read_sse
+
+server_url = "http://127.0.0.1:5000"
 
 def upload_file_to_server(pdfs, images, company_name):
 
 
-    url = "http://127.0.0.1:5000/upload"  
+    url = f"{server_url}/upload/stream"
     upload_files = []
     if pdfs:
         for file in pdfs:
@@ -18,16 +22,20 @@ def upload_file_to_server(pdfs, images, company_name):
 
 
     data = {'company_name': company_name}
-    response = requests.post(url, files=upload_files, data=data, timeout=1000)
+    # 以 SSE 串流接收每一題的答案，產生一題就顯示一題，PDF 完成後再顯示下載連結
+    response = requests.post(url, files=upload_files, data=data, stream=True, timeout=(60, 1000))
 
 
     print(response)
     if response.status_code != 200:
-        return "文件上傳失败"
+        yield "文件上傳失败"
+        return
 
-    data = response.json()
-    download_link = data.get("download_link", "#")
-    return f"<a href='http://127.0.0.1:5000{download_link}' target='_blank'>下载報告</a>"
+    view = ReportView(server_url)
+    for event, event_data in read_sse(response):
+        view.update(event, event_data)
+        if event != "questions":
+            yield view.render()
 
 def clear_files():
     return None, None, None
@@ -43,11 +51,11 @@ with gr.Blocks() as build:
     upload_button.click(upload_file_to_server, inputs=[pdf_input, image_input, company_input], outputs=outputs)
     clear_button.click(clear_files, outputs=[pdf_input, image_input, company_input])
 
-def predict(message, history):
-    bot = ConversationBot()
-    response = bot.start_process(message)
+bot_pool = BotPool(ConversationBot)
 
-    return response
+def predict(message, history, request: gr.Request):
+    # 以 generator 逐步回傳答案，Gradio 會即時更新對話框
+    yield from bot_pool.stream(request.session_hash, message)
 
 chat = gr.ChatInterface(predict, css="#component-9 { height:calc(120vh - 380px)!important; }")
 
@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.vectorstores import FAISS
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.compact_index import is_compact_index, load_compact_index, save_compact_index
+from common.chunker import RecursiveChunker, get_chunker
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# 同一個 process 內的多個 bot 共用同一個 ./faiss_index，寫入時要排隊
+_index_lock = threading.Lock()
+
+
+def _hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def empty_manifest():
+    return {"version": MANIFEST_VERSION, "chunker": get_chunker().signature(), "files": {}}
+
+
+def load_manifest(save_path):
+    path = os.path.join(save_path, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest, save_path):
+    path = os.path.join(save_path, MANIFEST_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_indexed(embeddings, save_path):
+    # 沒有 manifest 的舊索引無法比對內容，視為需要重建
+    # 切段設定 (CHUNKER / CHUNK_TOKENS ...) 改變時也整份重建，沒有記錄的舊 manifest 是預設的 recursive
+    manifest = load_manifest(save_path)
+    if manifest is None or not is_compact_index(save_path):
+        return None, empty_manifest()
+    if manifest.get("chunker", RecursiveChunker.name) != get_chunker().signature():
+        return None, empty_manifest()
+    docsearch = load_compact_index(save_path, embeddings, mutable=True)
+    return docsearch, manifest
+
+
+def _page_ids(filename, pages):
+    # 以檔名 + 頁面內容雜湊當作 docstore id，同檔案內重複的頁面再加上序號
+    prefix = _hash_bytes(filename.encode("utf-8"))[:16]
+    seen = {}
+    entries = []
+    for page in pages:
+        page_hash = _hash_bytes(page.encode("utf-8"))
+        count = seen.get(page_hash, 0)
+        seen[page_hash] = count + 1
+        entries.append((f"{prefix}-{page_hash}-{count}", page))
+    return entries
+
+
+def _scan_pdfs(documents_path):
+    files = {}
+    if not os.path.exists(documents_path):
+        return files
+    # 後端依 job id 分目錄存放上傳檔案，以相對路徑當作 key；被清除的目錄下次同步時會從索引移除
+    # 還在寫入的 .pdf.part 暫存檔不會被掃到
+    for directory, _, filenames in os.walk(documents_path):
+        for filename in filenames:
+            if filename.endswith(".pdf"):
+                path = os.path.join(directory, filename)
+                stat = os.stat(path)
+                files[os.path.relpath(path, documents_path).replace(os.sep, "/")] = (stat.st_size, stat.st_mtime_ns)
+    return dict(sorted(files.items()))
+
+
+def has_changes(manifest, documents_path="../upload/"):
+    files = _scan_pdfs(documents_path)
+    if set(files) != set(manifest["files"]):
+        return True
+    for filename, (size, mtime) in files.items():
+        entry = manifest["files"][filename]
+        if entry["size"] != size or entry["mtime"] != mtime:
+            return True
+    return False
+
+
+def sync_faiss_index(docsearch, manifest, embeddings, documents_path="../upload/", save_path="./faiss_index"):
+    files = _scan_pdfs(documents_path)
+    chunker = get_chunker()
+    new_files = {}
+    add_texts, add_ids, add_metadatas = [], [], []
+    remove_ids = []
+
+    for filename, (size, mtime) in files.items():
+        path = os.path.join(documents_path, filename)
+        entry = manifest["files"].get(filename)
+        if entry and entry["size"] == size and entry["mtime"] == mtime:
+            new_files[filename] = entry
+            continue
+
+        file_hash = _hash_file(path)
+        if entry and entry["sha256"] == file_hash:
+            new_files[filename] = dict(entry, size=size, mtime=mtime)
+            continue
+
+        loader = PyPDFLoader(path)
+        chunks = []
+        for page_number, page in enumerate(loader.load()):
+            chunks.extend(chunker.split_page(page.page_content, {"source": filename, "page": page_number}))
+        entries = _page_ids(filename, [text for text, _ in chunks])
+
+        old_ids = set(entry["pages"]) if entry else set()
+        new_ids = [page_id for page_id, _ in entries]
+        for (page_id, text), (_, metadata) in zip(entries, chunks):
+            if page_id not in old_ids:
+                add_ids.append(page_id)
+                add_texts.append(text)
+                add_metadatas.append(metadata)
+        remove_ids.extend(old_ids.difference(new_ids))
+
+        new_files[filename] = {"sha256": file_hash, "size": size, "mtime": mtime, "pages": new_ids}
+
+    for filename, entry in manifest["files"].items():
+        if filename not in files:
+            remove_ids.extend(entry["pages"])
+
+    new_manifest = {"version": MANIFEST_VERSION, "chunker": chunker.signature(), "files": new_files}
+    if not add_texts and not remove_ids:
+        if new_files != manifest["files"] or new_manifest["chunker"] != manifest.get("chunker"):
+            with _index_lock:
+                os.makedirs(save_path, exist_ok=True)
+                save_manifest(new_manifest, save_path)
+        return docsearch, new_manifest, False
+
+    if docsearch is not None and remove_ids:
+        docsearch.delete(remove_ids)
+    if add_texts:
+        if docsearch is None:
+            docsearch = FAISS.from_texts(add_texts, embeddings, metadatas=add_metadatas, ids=add_ids)
+        else:
+            docsearch.add_texts(add_texts, metadatas=add_metadatas, ids=add_ids)
+
+    print(f"FAISS index synced: +{len(add_texts)} / -{len(remove_ids)} pages")
+
+    with _index_lock:
+        save_compact_index(docsearch, save_path)
+        save_manifest(new_manifest, save_path)
+
+    return docsearch, new_manifest, True
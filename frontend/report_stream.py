@@ -0,0 +1,68 @@
+import json
+import html
+
+
+def read_sse(response):
+    # 解析 requests 的串流回應，逐一回傳 (event, data)
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+
+class ReportView:
+    def __init__(self, server_url):
+        self.server_url = server_url
+        self.stage = None
+        self.questions = []
+        self.answers = {}
+        self.partials = {}
+        self.download_link = None
+        self.error = None
+
+    def update(self, event, data):
+        if event == "stage":
+            self.stage = data["stage"]
+        elif event == "questions":
+            self.questions = data
+        elif event == "token" and data["index"] is not None:
+            self.partials[data["index"]] = self.partials.get(data["index"], "") + data["token"]
+        elif event == "answer":
+            self.answers[data["index"]] = data["answer"]
+            self.partials.pop(data["index"], None)
+        elif event == "done":
+            self.download_link = data["download_link"]
+        elif event == "error":
+            self.error = data["error"]
+
+    def render(self):
+        parts = []
+        if self.download_link:
+            parts.append(f"<p><a href='{self.server_url}{self.download_link}' target='_blank'>下载報告</a></p>")
+        elif self.error:
+            parts.append(f"<p>報告產生失败：{html.escape(self.error)}</p>")
+        else:
+            parts.append(f"<p>報告產生中 ({self.stage or 'queued'}) 已完成 {len(self.answers)}/{len(self.questions)} 題</p>")
+
+        section = None
+        for item in self.questions:
+            index = item["index"]
+            if index not in self.answers and index not in self.partials:
+                continue
+            if item["section"] != section:
+                section = item["section"]
+                parts.append(f"<h3>{html.escape(section)}</h3>")
+            answer = self.answers.get(index, self.partials.get(index, ""))
+            parts.append(f"<h4>{html.escape(item['question'])}</h4>")
+            parts.append(f"<p style='white-space: pre-wrap'>{html.escape(answer)}</p>")
+        return "\n".join(parts)